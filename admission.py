@@ -0,0 +1,89 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__('Сервер перегружен, попробуйте позже')
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Ограничивает число одновременных анализов и длину очереди ожидания.
+
+    Запросы сверх лимита ждут в очереди не дольше queue_timeout; если очередь полна
+    или время вышло, бросается Overloaded с оценкой Retry-After по текущей скорости
+    обслуживания.
+    """
+
+    def __init__(self, max_in_flight=64, queue_size=32, queue_timeout=2.0, alpha=0.2):
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.alpha = alpha
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._service_time = None
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        # Возвращает метку начала, которую нужно передать в release()
+        with self._cond:
+            if self.in_flight >= self.max_in_flight:
+                if self.waiting >= self.queue_size:
+                    self._reject()
+                self.waiting += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject()
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started):
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self.in_flight -= 1
+            if self._service_time is None:
+                self._service_time = elapsed
+            else:
+                self._service_time += self.alpha * (elapsed - self._service_time)
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self):
+        started = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def retry_after(self):
+        # Скорость обслуживания - max_in_flight / среднее время анализа; повторять
+        # имеет смысл, когда успеет пройти очередь перед клиентом
+        if self._service_time is None:
+            return 1
+        return max(1, math.ceil((self.waiting + 1) * self._service_time / self.max_in_flight))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'rejected': self.rejected,
+                'service_time': self._service_time,
+                'max_in_flight': self.max_in_flight,
+                'queue_size': self.queue_size,
+            }
+
+    def _reject(self):
+        self.rejected += 1
+        raise Overloaded(self.retry_after())
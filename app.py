@@ -1,116 +1,934 @@
-from flask import Flask, request, jsonify
-import g4f
-import g4f.Provider
+from flask import Flask, Response, g, request, jsonify
 import base64
+import hashlib
+import json
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from io import BytesIO
-from PIL import Image
+
+import config
+from admission import AdmissionController, Overloaded
+from assets import Assets, StaticFile
+from cache import ResultCache, SingleFlight, make_key
+from jobs import JobManager, QueueFull
+from lazy import lazy_import
+from metrics import CONTENT_TYPE, Registry, process_collector
+from imaging import encode_compact, measure_sheet, preprocess_image
+from phash import NearDuplicateIndex, dhash, index_entry
+from providers import ClientPool, DeadlineExceeded, ProviderRouter, remaining
+from rules import interpret
+from sections import SECTIONS, build_prompt, build_section_prompt, merge_sections
+from store import AnalysisStore
+from strokes import InvalidStrokes, parse_strokes, raster_size, rasterize, stroke_features
+from warmup import NotReady, Preflight
+
+# PIL и g4f загружаются прогревом в фоне, а не при импорте модуля
+Image = lazy_import('PIL.Image')
 
 app = Flask(__name__)
 
-def analyze_image_with_ai(image_data, name, description):
-    # Улучшенный промпт для анализа изображения
-    prompt = f"""
-    Ты - профессиональный психолог, анализирующий рисунки несуществующих животных. 
-    Перед тобой рисунок животного "{name}" с описанием: "{description}".
+MODES = ('full', 'sections', 'fast')
+
+
+class InvalidRequest(ValueError):
+    pass
+
+
+# Перцептивные хэши прошлых рисунков для поиска почти одинаковых; ключи,
+# покинувшие кэш результатов, удаляются и из индекса
+near_index = NearDuplicateIndex(
+    max_distance=config.PHASH_MAX_DISTANCE,
+    bbox_tolerance=config.PHASH_BBOX_TOLERANCE,
+)
+
+result_cache = ResultCache(
+    memory_size=config.CACHE_MEMORY_SIZE,
+    directory=config.CACHE_DIR,
+    ttl=config.CACHE_TTL,
+    disk_max_bytes=config.CACHE_DISK_MAX_BYTES,
+    on_evict=near_index.discard,
+)
+
+# Сверх лимита одновременных анализов запросы ждут в короткой очереди, затем получают 429
+admission = AdmissionController(
+    max_in_flight=config.MAX_IN_FLIGHT,
+    queue_size=config.ADMISSION_QUEUE_SIZE,
+    queue_timeout=config.ADMISSION_QUEUE_TIMEOUT,
+)
+
+singleflight = SingleFlight()
+
+# Разделы анализа в режиме sections запрашиваются параллельно
+section_executor = ThreadPoolExecutor(max_workers=config.SECTION_WORKERS, thread_name_prefix='section')
+
+# История анализов: запись в фоне, чтение по идентификатору и постранично
+analysis_store = AnalysisStore(
+    config.STORE_PATH,
+    queue_size=config.STORE_QUEUE_SIZE,
+    thumbnail_side=config.STORE_THUMBNAIL_SIDE,
+)
+
+job_manager = JobManager(
+    workers=config.JOB_WORKERS,
+    queue_size=config.JOB_QUEUE_SIZE,
+    ttl=config.JOB_TTL,
+)
+
+# Сторонние скрипты страницы отдаются из памяти по адресам с хэшем содержимого
+assets = Assets()
+
+# Клиенты g4f создаются один раз на процесс и переиспользуются между запросами;
+# маршрутизатор выбирает самого быстрого здорового провайдера из списка.
+# Провайдеры разрешаются по имени при прогреве
+router = ProviderRouter(
+    {name: ClientPool(name, size=config.CLIENT_POOL_SIZE) for name in config.PROVIDERS},
+    hedge_after=config.HEDGE_AFTER,
+    alpha=config.ROUTER_EWMA_ALPHA,
+    min_success_rate=config.ROUTER_MIN_SUCCESS_RATE,
+    cooldown=config.ROUTER_COOLDOWN,
+    workers=config.UPSTREAM_WORKERS,
+)
+
+def warm_up_imaging():
+    # Пробный рисунок проходит весь путь обработки: импорт PIL и numpy, плагины
+    # форматов и кодировщики загружаются до первого запроса
+    canvas = Image.new('RGBA', (64, 64), (0, 0, 0, 0))
+    canvas.paste((0, 96, 100, 255), (16, 16, 48, 48))
+    buffer = BytesIO()
+    canvas.save(buffer, 'PNG')
+    image, _ = preprocess_image(Image.open(BytesIO(buffer.getvalue())), max_side=config.IMAGE_MAX_SIDE)
+    dhash(image)
+    encode_compact(image, max_colors=config.IMAGE_PALETTE_COLORS, webp=config.IMAGE_WEBP)
+    # Быстрый анализ уменьшает лист до признаков; проверяем его и на палитровых и 1-битных PNG
+    for mode in ('P', '1'):
+        buffer = BytesIO()
+        canvas.convert(mode).save(buffer, 'PNG')
+        measure_sheet(Image.open(BytesIO(buffer.getvalue())), max_side=16)
+    rasterize(parse_strokes({'size': [10, 8], 'strokes': [{'width': 1, 'points': [1, 1, 8, 6]}]}), 64)
+
+def warm_up_providers():
+    router.warm_up(clients=bool(config.CLIENT_POOL_WARMUP))
+
+def warm_up_assets():
+    # Сжатые копии скриптов и главной страницы готовы до первого визита
+    assets.warm_up()
+    index_page.encoded()
+
+def warm_up_near_index():
+    # После перезапуска индекс почти одинаковых рисунков собирается из дискового кэша
+    near_index.rebuild(result_cache.entries())
+
+# Процесс принимает запросы сразу после импорта, тяжёлая подготовка идёт в фоне;
+# /ready отвечает 200, а запросы анализа обслуживаются, когда она закончится.
+# Поток запускается в каждом процессе-обработчике (gunicorn без preload_app)
+preflight = Preflight(
+    [
+        ('imaging', warm_up_imaging),
+        ('near_index', warm_up_near_index),
+        ('assets', warm_up_assets),
+        ('providers', warm_up_providers),
+    ],
+    retry_delay=config.WARMUP_RETRY,
+)
+
+# Эндпоинты анализа: быстрому анализу и запасным ответам нужна только обработка
+# изображений, анализу моделью - ещё и подготовленные провайдеры
+WARM_ENDPOINTS = {'analyze', 'analyze_stream', 'analyze_batch', 'create_job'}
+
+# Метрики процесса для Prometheus (/metrics)
+metrics = Registry()
+stage_seconds = metrics.histogram(
+    'neuro_stage_seconds', 'Длительность этапов анализа в секундах', ['stage'],
+)
+request_seconds = metrics.histogram(
+    'neuro_request_seconds', 'Полное время обработки запроса до закрытия ответа', ['endpoint'],
+)
+requests_total = metrics.counter('neuro_requests_total', 'Обработанные запросы', ['endpoint', 'status'])
+requests_in_flight = metrics.gauge('neuro_requests_in_flight', 'Запросы, обрабатываемые сейчас')
+errors_total = metrics.counter('neuro_errors_total', 'Ошибки анализа по типу исключения', ['type'])
+metrics.register_collector(process_collector)
+
+@metrics.register_collector
+def collect_component_stats():
+    # Счётчики кэша, объединения запросов и допуска уже ведутся в самих компонентах
+    cache = result_cache.stats()
+    flights = singleflight.stats()
+    near = near_index.stats()
+    gate = admission.stats()
+    store = analysis_store.stats()
+    return [
+        ('neuro_ready', 'gauge', 'Процесс прогрет и принимает запросы анализа',
+         [({}, 1 if preflight.ready else 0)]),
+        ('neuro_cache_lookups_total', 'counter', 'Обращения к кэшу результатов', [
+            ({'result': 'memory_hit'}, cache['memory_hits']),
+            ({'result': 'disk_hit'}, cache['disk_hits']),
+            ({'result': 'miss'}, cache['misses']),
+        ]),
+        ('neuro_cache_entries', 'gauge', 'Записи кэша в памяти', [({}, cache['memory_entries'])]),
+        ('neuro_coalesced_total', 'counter', 'Запросы, дождавшиеся одинакового анализа',
+         [({}, flights['coalesced'])]),
+        ('neuro_near_duplicate_matches_total', 'counter', 'Найденные почти одинаковые рисунки',
+         [({}, near['hits'])]),
+        ('neuro_analyses_in_flight', 'gauge', 'Анализы, занявшие место в лимите', [({}, gate['in_flight'])]),
+        ('neuro_analyses_waiting', 'gauge', 'Анализы в очереди допуска', [({}, gate['waiting'])]),
+        ('neuro_rejected_total', 'counter', 'Запросы, отклонённые с 429', [({}, gate['rejected'])]),
+        ('neuro_store_queued', 'gauge', 'Анализы в очереди записи истории', [({}, store['queued'])]),
+        ('neuro_store_dropped_total', 'counter', 'Анализы, не попавшие в историю',
+         [({}, store['dropped'] + store['write_errors'])]),
+    ]
+
+@contextmanager
+def stage(name, timings=None):
+    # Время этапа идёт в метрики и, если передан словарь, в тайминги анализа (мс)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=name)
+        if timings is not None:
+            timings[name + '_ms'] = round(elapsed * 1000, 1)
+
+def decode_image(image_data):
+    # Изображение из multipart-формы уже пришло в виде байтов
+    if isinstance(image_data, bytes):
+        return image_data
+    # Декодируем base64, всё дальнейшее происходит в памяти
+    with stage('decode'):
+        image_data = re.sub('^data:image/.+;base64,', '', image_data)
+        return base64.b64decode(image_data)
+
+def prepare_image(image_bytes, timings=None, strokes=None):
+    # Обрезаем лист до рисунка и уменьшаем; хэш считаем по обрезанному рисунку.
+    # strokes - признаки журнала штрихов, если рисунок пришёл им
+    # Image.open читает только заголовок, пиксели декодируются при предобработке
+    with stage('open', timings):
+        image = Image.open(BytesIO(image_bytes))
+    with stage('preprocess', timings):
+        image, features = preprocess_image(
+            image,
+            max_side=config.IMAGE_MAX_SIDE,
+            margin=config.IMAGE_CROP_MARGIN,
+        )
+        features['phash'] = dhash(image)
+    if strokes:
+        features['strokes'] = strokes
+    return image, features
+
+def drawing_from_strokes(raw, raster_width=None):
+    # Журнал штрихов -> (PNG-байты растра заданной ширины, признаки штрихов);
+    # дальше рисунок обрабатывается так же, как присланный картинкой
+    width = strokes_raster_width(raster_width)
+    with stage('rasterize'):
+        log = parse_strokes(raw, max_points=config.STROKES_MAX_POINTS)
+        buffer = BytesIO()
+        rasterize(log, width, max_side=config.STROKES_RASTER_MAX).save(buffer, 'PNG', compress_level=1)
+    return buffer.getvalue(), stroke_features(log)
+
+def strokes_raster_width(value):
+    try:
+        width = int(value) if value else config.STROKES_RASTER_WIDTH
+    except (TypeError, ValueError):
+        raise InvalidStrokes('raster_width должен быть целым числом')
+    return min(max(width, 64), config.STROKES_RASTER_MAX)
+
+def encode_for_upload(image, original_size, timings=None):
+    # Кодируем в компактный формат в памяти: общего временного файла нет,
+    # параллельные запросы не мешают друг другу
+    with stage('encode', timings):
+        data, filename, report = encode_compact(
+            image,
+            max_colors=config.IMAGE_PALETTE_COLORS,
+            webp=config.IMAGE_WEBP,
+        )
+    app.logger.info(
+        "Изображение закодировано в %s за %.1f мс: %d -> %d байт (сэкономлено %d)",
+        report['format'], report['encode_ms'], original_size, report['bytes'],
+        original_size - report['bytes'],
+    )
+    return [[data, filename]]
+
+def public_features(features):
+    # Пиксельные координаты и хэш нужны только серверу, клиенту отдаём доли листа
+    return {key: value for key, value in features.items() if key not in ('bbox_px', 'phash')}
+
+def find_near_duplicate(name, description, mode, features):
+    # Почти такой же рисунок с тем же названием и описанием уже анализировался в этом режиме
+    variant = analysis_variant(mode)
+    for distance, key in near_index.find(name, description, variant, features['phash'], features['bbox']):
+        stored = result_cache.get(key)
+        if stored is not None:
+            return dict(stored, approximate=True, distance=distance)
+        # Запись истекла, не дождавшись вытеснения
+        near_index.discard(key)
+    return None
+
+def remember(result, image_bytes, image, name, description, timings):
+    # Сохраняем анализ в историю; запись и миниатюра делаются в фоне
+    analysis_id = analysis_store.save({
+        'image_hash': hashlib.sha256(image_bytes).hexdigest(),
+        'name': name,
+        'description': description,
+        'analysis': result['analysis'],
+        'provider': result.get('provider'),
+        'features': result.get('features'),
+        'timings': timings,
+    }, image=image)
+    if analysis_id is not None:
+        result['id'] = analysis_id
+    return result
+
+def fast_analysis(features, name, description):
+    # Локальный анализ по правилам, без обращения к провайдеру
+    result = interpret(features, name, description)
+    result['features'] = public_features(features)
+    result['mode'] = 'fast'
+    return result
+
+def iter_sections(name, description, features, images, deadline):
+    # Разделы запрашиваются параллельно и отдаются по мере готовности: (номер, раздел).
+    # Ошибка или срок в одном разделе не мешают остальным
+    def request_section(section):
+        key, title, _ = section
+        try:
+            response, provider = router.complete(
+                [{"content": build_section_prompt(section, name, description, features), "role": "user"}],
+                images=images,
+                deadline=deadline,
+            )
+        except Exception as e:
+            errors_total.inc(type=type(e).__name__)
+            return {'key': key, 'title': title, 'error': str(e), 'timed_out': isinstance(e, TimeoutError)}
+        return {'key': key, 'title': title, 'content': response.choices[0].message.content, 'provider': provider}
+    
+    futures = {section_executor.submit(request_section, section): index for index, section in enumerate(SECTIONS)}
+    pending = dict(futures)
+    try:
+        for future in as_completed(futures, timeout=remaining(deadline)):
+            yield pending.pop(future), future.result()
+    except TimeoutError:
+        for index in sorted(pending.values()):
+            key, title, _ = SECTIONS[index]
+            yield index, {'key': key, 'title': title, 'error': 'истекло время ожидания', 'timed_out': True}
+    finally:
+        for future in futures:
+            future.cancel()
+
+def collect_sections(sections):
+    # Локальная сборка разделов: (текст, провайдеры, все ли разделы получены)
+    received = [section for section in sections.values() if 'content' in section]
+    if not received:
+        if sections and all(section['timed_out'] for section in sections.values()):
+            raise DeadlineExceeded()
+        raise RuntimeError(next(iter(sections.values()))['error'] if sections else 'Разделы не получены')
+    providers = ', '.join(sorted({section['provider'] for section in received}))
+    return merge_sections(sections), providers, len(received) == len(SECTIONS)
+
+def timeout_fallback(image_bytes, name, description):
+    # Срок истёк раньше, чем пришёл ответ: отдаём локальный анализ
+    features = measure_sheet(Image.open(BytesIO(image_bytes)), max_side=config.FAST_MAX_SIDE)
+    result = fast_analysis(features, name, description)
+    result.update(fallback=True, timed_out=True)
+    return result
+
+def analysis_variant(mode):
+    # Результаты режимов full и sections кэшируются и сравниваются раздельно
+    return 'sections' if mode == 'sections' else ''
+
+def analysis_key(image_bytes, name, description, mode):
+    return make_key(image_bytes, name, description, analysis_variant(mode))
+
+def progressive_analysis(image_data, name, description, mode='full', force=False, timeout=None, strokes=None):
+    # Первый уровень - мгновенный локальный анализ по измеренным признакам; полный
+    # анализ ставится фоновым заданием, его адрес отдаётся в поле upgrade
+    try:
+        image_bytes = decode_image(image_data)
+        cached = None if force else result_cache.get(analysis_key(image_bytes, name, description, mode))
+    except Exception as e:
+        errors_total.inc(type=type(e).__name__)
+        return {'error': f"Произошла ошибка при анализе: {str(e)}"}
+    if cached is not None:
+        return dict(cached)
     
-    Проведи детальный анализ по следующим критериям:
+    summary = analyze_image_with_ai(image_bytes, name, description, mode='fast', strokes=strokes)
+    if 'error' in summary:
+        return summary
+    summary['tier'] = 'summary'
+    try:
+        job_id = job_manager.submit(
+            analyze_image_with_ai, image_bytes, name, description, mode=mode, force=force, timeout=timeout,
+            strokes=strokes,
+        )
+    except QueueFull:
+        # Очередь заданий полна: клиент получает хотя бы первый уровень
+        summary['upgrade'] = None
+        return summary
+    summary['upgrade'] = {'job_id': job_id, 'url': f'/jobs/{job_id}'}
+    return summary
+
+def analyze_image_with_ai(image_data, name, description, mode='full', force=False, timeout=None, strokes=None):
+    # Срок отсчитывается от начала анализа, для заданий - от начала выполнения
+    deadline = time.monotonic() + (timeout or config.REQUEST_TIMEOUT)
+    try:
+        image_bytes = decode_image(image_data)
+        
+        if mode == 'fast':
+            with stage('open'):
+                image = Image.open(BytesIO(image_bytes))
+            with stage('preprocess'):
+                features = measure_sheet(image, max_side=config.FAST_MAX_SIDE)
+            if strokes:
+                features['strokes'] = strokes
+            return fast_analysis(features, name, description)
+        
+        # Повторная отправка того же рисунка отдаётся из кэша без обращения к провайдеру;
+        # force запрашивает свежий анализ
+        cache_key = analysis_key(image_bytes, name, description, mode)
+        cached = None if force else result_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
+        # Одинаковые одновременные запросы ждут результат первого, а не идут к провайдеру сами
+        try:
+            result = singleflight.do(
+                cache_key,
+                lambda: run_full_analysis(image_bytes, name, description, cache_key, force, deadline, mode, strokes),
+                timeout=remaining(deadline),
+            )
+        except TimeoutError as e:
+            errors_total.inc(type=type(e).__name__)
+            return timeout_fallback(image_bytes, name, description)
+        return dict(result)
+    except Exception as e:
+        errors_total.inc(type=type(e).__name__)
+        return {'error': f"Произошла ошибка при анализе: {str(e)}"}
+
+def run_full_analysis(image_bytes, name, description, cache_key, force=False, deadline=None, mode='full',
+                      strokes=None):
+    started = time.perf_counter()
+    timings = {}
+    image, features = prepare_image(image_bytes, timings, strokes)
+    if not force:
+        near = find_near_duplicate(name, description, mode, features)
+        if near is not None:
+            return near
+    images = encode_for_upload(image, len(image_bytes), timings)
     
-    1. Внешний вид (на что похоже животное):
-    - На какие реальные или фантастические существа оно похоже
-    - Основные визуальные характеристики
-    - Уникальные особенности
+    # Основной анализ у самого быстрого доступного провайдера; в режиме sections -
+    # параллельные запросы разделов, время определяется самым долгим из них
+    try:
+        with stage('upstream', timings):
+            if mode == 'sections':
+                sections = dict(iter_sections(name, description, features, images, deadline))
+                analysis, provider, complete = collect_sections(sections)
+            else:
+                response, provider = router.complete(
+                    [{"content": build_prompt(name, description, features), "role": "user"}], 
+                    images=images,
+                    deadline=deadline,
+                )
+                analysis, complete = response.choices[0].message.content, True
+    except Exception as e:
+        # Все провайдеры недоступны или не успели: отвечаем локальным анализом, в кэш его не кладём
+        errors_total.inc(type=type(e).__name__)
+        app.logger.warning("Провайдеры недоступны, используется быстрый анализ: %s", e)
+        result = fast_analysis(features, name, description)
+        result['fallback'] = True
+        if isinstance(e, DeadlineExceeded):
+            result['timed_out'] = True
+        timings['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return remember(result, image_bytes, image, name, description, timings)
+    result = {
+        'analysis': analysis,
+        'features': public_features(features),
+        'provider': provider,
+    }
+    if mode == 'sections':
+        result['mode'] = 'sections'
+    timings['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    remember(result, image_bytes, image, name, description, timings)
+    # Анализ с недостающими разделами не кэшируем
+    if not complete:
+        result['partial'] = True
+        return result
+    meta = index_entry(name, description, analysis_variant(mode), features['phash'], features['bbox'])
+    result_cache.set(cache_key, result, meta=meta)
+    near_index.add(name, description, meta['variant'], features['phash'], features['bbox'], cache_key)
+    return result
+
+def stream_analysis_with_ai(image_data, name, description, mode='full', force=False, timeout=None,
+                            progressive=False, strokes=None):
+    # Потоковый вариант: отдаёт события ('features', признаки), с progressive -
+    # ('summary', локальный анализ) до ответа модели, затем ('delta', текст) или,
+    # в режиме sections, ('section', раздел) по мере готовности, и наконец
+    # ('done', результат) или ('error', текст)
+    if mode == 'fast':
+        yield 'done', analyze_image_with_ai(image_data, name, description, mode, strokes=strokes)
+        return
     
-    2. Психологический анализ:
-    а) Расположение на листе:
-    - Где расположен рисунок (центр, верх, низ, лево, право)
-    - Животное расположено ближе к левому или правому краю?
-    Если к правому - взгляд в будущее, надежда на лучшее(в зависимости от контекста), Если к левому - зацикленность на прошлом, неуверенность. 
-    - Интерпретация расположения
+    deadline = time.monotonic() + (timeout or config.REQUEST_TIMEOUT)
     
-    б) Размер и пропорции:
-    - Размер относительно листа
-    Крупное - уверенность или эгоцентричность, Мелкое - неуверенность, мелочность. Выходит за рамки - Когнитивный диссонанс, неуровновешенность, отсутствие самоконтроля
-    - Пропорции тела
-    Голова больше туловища - Тревожность или сосредоточенность на себе. Туловище больше - желание быть сильным.
-    - Интерпретация размера
+    parts = []
+    features = None
+    try:
+        image_bytes = decode_image(image_data)
+        
+        cache_key = analysis_key(image_bytes, name, description, mode)
+        cached = None if force else result_cache.get(cache_key)
+        if cached is not None:
+            yield 'done', dict(cached)
+            return
+        
+        call, leader = singleflight.begin(cache_key)
+        if not leader:
+            # Такой же анализ уже выполняется: ждём его результат
+            try:
+                result = dict(call.wait(remaining(deadline)))
+            except TimeoutError as e:
+                errors_total.inc(type=type(e).__name__)
+                result = timeout_fallback(image_bytes, name, description)
+            yield 'done', result
+            return
+        result = None
+        started = time.perf_counter()
+        timings = {}
+        try:
+            image, features = prepare_image(image_bytes, timings, strokes)
+            # Измеренные признаки готовы раньше первого токена модели
+            yield 'features', public_features(features)
+            if progressive:
+                yield 'summary', dict(fast_analysis(features, name, description), tier='summary')
+            
+            result = None if force else find_near_duplicate(name, description, mode, features)
+            if result is not None:
+                yield 'done', result
+                return
+            images = encode_for_upload(image, len(image_bytes), timings)
+            
+            provider = None
+            complete = True
+            # Время до последнего фрагмента, включая передачу уже полученных клиенту
+            upstream_started = time.perf_counter()
+            if mode == 'sections':
+                sections = {}
+                chunks = iter_sections(name, description, features, images, deadline)
+            else:
+                chunks = router.stream(
+                    [{"content": build_prompt(name, description, features), "role": "user"}], 
+                    images=images,
+                    deadline=deadline,
+                )
+            # Если клиент отключился, генератор закрывается здесь же и останавливает
+            # чтение ответа провайдера
+            try:
+                if mode == 'sections':
+                    for index, section in chunks:
+                        sections[index] = section
+                        yield 'section', dict(section, index=index)
+                    analysis, provider, complete = collect_sections(sections)
+                else:
+                    for provider, chunk in chunks:
+                        delta = chunk.choices[0].delta.content if chunk.choices else None
+                        if delta:
+                            parts.append(delta)
+                            yield 'delta', delta
+                    analysis = ''.join(parts)
+            finally:
+                chunks.close()
+            upstream_seconds = time.perf_counter() - upstream_started
+            stage_seconds.observe(upstream_seconds, stage='upstream')
+            timings['upstream_ms'] = round(upstream_seconds * 1000, 1)
+            result = {
+                'analysis': analysis,
+                'features': public_features(features),
+                'provider': provider,
+            }
+            if mode == 'sections':
+                result['mode'] = 'sections'
+            timings['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            remember(result, image_bytes, image, name, description, timings)
+            if complete:
+                meta = index_entry(name, description, analysis_variant(mode), features['phash'], features['bbox'])
+                result_cache.set(cache_key, result, meta=meta)
+                near_index.add(name, description, meta['variant'], features['phash'], features['bbox'], cache_key)
+            else:
+                result['partial'] = True
+        except Exception as e:
+            if features is None or (parts and not isinstance(e, DeadlineExceeded)):
+                raise
+            errors_total.inc(type=type(e).__name__)
+            if parts:
+                # Срок истёк посреди ответа: отдаём то, что успели получить, без кэширования
+                result = {
+                    'analysis': ''.join(parts) + '\n\n_Анализ не завершён: истекло время ожидания._',
+                    'features': public_features(features),
+                    'provider': provider,
+                    'partial': True,
+                    'timed_out': True,
+                }
+            else:
+                # Провайдеры отказали или не успели до первого фрагмента: отдаём локальный анализ
+                app.logger.warning("Провайдеры недоступны, используется быстрый анализ: %s", e)
+                result = fast_analysis(features, name, description)
+                result['fallback'] = True
+                if isinstance(e, DeadlineExceeded):
+                    result['timed_out'] = True
+            timings['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            remember(result, image_bytes, image, name, description, timings)
+        finally:
+            error = None if result is not None else RuntimeError('Анализ прерван')
+            singleflight.finish(cache_key, call, result=result, error=error)
+        yield 'done', result
+    except Exception as e:
+        errors_total.inc(type=type(e).__name__)
+        yield 'error', {'error': f"Произошла ошибка при анализе: {str(e)}"}
+
+def read_analysis_request():
+    # Изображение приходит либо файлом в multipart/form-data (Werkzeug держит
+    # крупные файлы во временном spooled-буфере), либо data URL внутри JSON.
+    # Вместо изображения страница может прислать журнал штрихов (поле strokes):
+    # растр шириной raster_width строится здесь, а признаки штрихов идут в анализ.
+    # Параметры анализа можно передать в теле или в строке запроса:
+    # mode ('full', 'sections' или 'fast'), force (не брать сохранённые результаты) и
+    # progressive (сразу краткий локальный анализ, полный - позже);
+    # срок анализа в секундах - заголовком X-Request-Timeout
+    with stage('parse'):
+        return _read_analysis_request()
+
+def _read_analysis_request():
+    if request.mimetype == 'multipart/form-data':
+        data = request.form
+        image = request.files.get('image')
+        image_data = image.read() if image is not None else None
+    else:
+        data = request.json
+        image_data = data.get('image')
+    name, description = data['name'], data['description']
     
-    в) Детализация:
-    - Уровень проработки деталей
-    - Какие элементы особенно выделены
-    Украшения - желание выделиться, Предметы - указания на увлечение, творческие способности.
-    - Интерпретация детализации
+    options = {
+        'mode': requested_mode(),
+        'force': _flag(data.get('force') or request.args.get('force')),
+        'progressive': _flag(data.get('progressive') or request.args.get('progressive')),
+        'timeout': request_timeout(),
+    }
+    if image_data is None:
+        if 'strokes' not in data:
+            raise InvalidStrokes('Нужно поле image или strokes')
+        image_data, options['strokes'] = drawing_from_strokes(
+            data['strokes'], data.get('raster_width') or request.args.get('raster_width'),
+        )
+    return image_data, name, description, options
+
+def requested_mode():
+    # Режим анализа из тела (форма или JSON) или строки запроса; нужен ещё до
+    # разбора запроса, чтобы решить, каких шагов прогрева ждать
+    if request.mimetype == 'multipart/form-data':
+        data = request.form
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = {}
+    mode = data.get('mode') or request.args.get('mode', 'full')
+    if mode not in MODES:
+        raise InvalidRequest(f'Неизвестный режим анализа: {mode} (допустимы {", ".join(MODES)})')
+    return mode
+
+def batch_item_error(item):
+    # Текст ошибки элемента пакета или None; проверяется до начала потока, иначе
+    # ошибка после отправленных заголовков просто оборвала бы ответ
+    if not isinstance(item, dict):
+        return 'элемент должен быть объектом'
+    for key in ('name', 'description'):
+        if not isinstance(item.get(key), str):
+            return f'нет поля {key}'
+    if item.get('image') is not None:
+        return None if isinstance(item['image'], str) else 'image должен быть data URL'
+    if 'strokes' not in item:
+        return 'нужно поле image или strokes'
+    try:
+        width = strokes_raster_width(item.get('raster_width'))
+        log = parse_strokes(item['strokes'], max_points=config.STROKES_MAX_POINTS)
+        raster_size(log, width, max_side=config.STROKES_RASTER_MAX)
+    except InvalidStrokes as e:
+        return str(e)
+    return None
+
+def _flag(value):
+    return str(value or '').lower() in ('1', 'true', 'yes')
+
+def request_timeout():
+    # Некорректное значение заголовка игнорируется, слишком большое урезается
+    try:
+        timeout = float(request.headers.get('X-Request-Timeout', ''))
+    except ValueError:
+        return config.REQUEST_TIMEOUT
+    if not timeout > 0:
+        return config.REQUEST_TIMEOUT
+    return min(timeout, config.REQUEST_TIMEOUT_MAX)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    requests_in_flight.inc()
+
+@app.before_request
+def wait_for_warmup():
+    if request.endpoint in WARM_ENDPOINTS:
+        steps = ['imaging'] if requested_mode() == 'fast' else ['imaging', 'providers']
+        preflight.require(config.WARMUP_WAIT, steps)
+
+@app.after_request
+def observe_request(response):
+    # Потоковые ответы считаются законченными, когда сервер закрыл их
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    endpoint = request.endpoint or 'unknown'
+    status = response.status_code
     
-    г) Особенности:
-    - Наличие агрессивных элементов (острые зубы, когти)
-    Желание напасть или защитится
-    - Защитные элементы (панцирь, шипы)
-    Защитные элементы
-    - Компенсаторные элементы (крылья, рога)
-    Крылья - желание свободы и независимости, рога - оборона.
-    - Эмоциональные признаки (глаза, рот)
-    Закрытый рот - антисоциальность, замкнутость, открытый рот - болтливость, нету рта - полное нежелание общаться
+    def finished():
+        requests_in_flight.dec()
+        request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+        requests_total.inc(endpoint=endpoint, status=status)
     
-    3. Анализ названия и описания:
-    - Лингвистические особенности названия
-    - Ключевые слова в описании
-    - Соответствие между рисунком и описанием
+    response.call_on_close(finished)
+    return response
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    errors_total.inc(type=type(e).__name__)
+    return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+
+@app.errorhandler(InvalidStrokes)
+def invalid_strokes(e):
+    errors_total.inc(type=type(e).__name__)
+    return jsonify({'error': str(e)}), 400
+
+@app.errorhandler(InvalidRequest)
+def invalid_request(e):
+    errors_total.inc(type=type(e).__name__)
+    return jsonify({'error': str(e)}), 400
+
+@app.errorhandler(NotReady)
+def not_ready(e):
+    return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    image_data, name, description, options = read_analysis_request()
     
-    4. Психологический портрет:
-    - Самооценка и уровень притязаний
-    - Эмоциональное состояние
-    - Социальные установки
-    - Механизмы психологической защиты
-    - Когнитивные особенности
+    # Двухуровневый ответ: краткий анализ сразу, полный - заданием /jobs/<id>.
+    # Как и быстрый режим, не занимает место в лимите: задания ограничены своей очередью
+    if options.pop('progressive') and options['mode'] != 'fast':
+        result = progressive_analysis(image_data, name, description, **options)
+        with stage('serialize'):
+            return jsonify(result)
     
-    Выводы:
-    - Основные психологические характеристики
-    - Рекомендации (если уместно)
+    # Быстрый режим не обращается к провайдеру и не занимает место в лимите
+    if options['mode'] == 'fast':
+        result = analyze_image_with_ai(image_data, name, description, **options)
+        with stage('serialize'):
+            return jsonify(result)
+    with admission.admit():
+        result = analyze_image_with_ai(image_data, name, description, **options)
+    with stage('serialize'):
+        return jsonify(result)
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    image_data, name, description, options = read_analysis_request()
     
-    Анализ должен быть конкретным, опираться на визуальные признаки рисунка и данные описания. 
-    Избегай общих фраз, делай акцент на уникальных особенностях данного рисунка.
-    """
+    # Server-Sent Events: фрагменты текста пересылаются по мере генерации
+    def generate():
+        for event, payload in stream_analysis_with_ai(image_data, name, description, **options):
+            if event == 'delta':
+                payload = {'delta': payload}
+            with stage('serialize'):
+                data = json.dumps(payload, ensure_ascii=False)
+            yield f"event: {event}\ndata: {data}\n\n"
     
-    try:
-        # Декодируем base64 и сохраняем временное изображение
-        image_data = re.sub('^data:image/.+;base64,', '', image_data)
-        image = Image.open(BytesIO(base64.b64decode(image_data)))
-        image.save("temp_animal.png", "PNG")
-        
-        # Основной анализ (Blackbox)
-        client = g4f.Client(provider=g4f.Provider.Blackbox)
-        images = [[open("temp_animal.png", "rb"), "animal.png"]]
-        response = client.chat.completions.create(
-            [{"content": prompt, "role": "user"}], 
-            "", 
-            images=images
-        )
-        return {'analysis': response.choices[0].message.content}
-    except Exception as e:
-        return {'error': f"Произошла ошибка при анализе: {str(e)}"}
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    response = Response(generate(), mimetype='text/event-stream', headers=headers)
+    # Место в лимите занято, пока поток не закрыт, даже если клиент ушёл раньше
+    if options['mode'] != 'fast':
+        started = admission.acquire()
+        response.call_on_close(lambda: admission.release(started))
+    return response
 
-@app.route('/analyze', methods=['POST'])
-def analyze():
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    # Тело: {"items": [{"image" или "strokes", "name", "description"}, ...], "mode": ..., "concurrency": ...}
     data = request.json
-    image_data = data['image']
-    name = data['name']
-    description = data['description']
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({'error': 'Ожидается поле items со списком рисунков'}), 400
+    mode = requested_mode()
+    if len(items) > config.BATCH_MAX_ITEMS:
+        return jsonify({'error': f'В пакете не может быть больше {config.BATCH_MAX_ITEMS} рисунков'}), 400
+    for index, item in enumerate(items):
+        error = batch_item_error(item)
+        if error is not None:
+            return jsonify({'error': f'Рисунок {index}: {error}', 'index': index}), 400
+    concurrency = data.get('concurrency')
+    try:
+        concurrency = config.BATCH_CONCURRENCY if concurrency is None else int(concurrency)
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'error': 'concurrency должен быть целым числом'}), 400
+    concurrency = max(1, min(concurrency, config.BATCH_CONCURRENCY))
+    # Срок действует на каждый рисунок с момента начала его анализа
+    timeout = request_timeout()
+    
+    def analyze_item(item):
+        strokes = None
+        image_data = item.get('image')
+        if image_data is None:
+            try:
+                image_data, strokes = drawing_from_strokes(item['strokes'], item.get('raster_width'))
+            except (InvalidStrokes, KeyError) as e:
+                errors_total.inc(type=type(e).__name__)
+                return {'error': f"Некорректный рисунок: {str(e)}"}
+        return analyze_image_with_ai(image_data, item['name'], item['description'], mode, timeout=timeout,
+                                     strokes=strokes)
+    
+    # Рисунки анализируются параллельно, результаты уходят NDJSON-строками по мере готовности
+    def generate():
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch')
+        try:
+            futures = {
+                executor.submit(analyze_item, item): index
+                for index, item in enumerate(items)
+            }
+            for future in as_completed(futures):
+                result = dict(future.result(), index=futures[future])
+                with stage('serialize'):
+                    line = json.dumps(result, ensure_ascii=False)
+                yield line + '\n'
+        finally:
+            # Клиент отключился: невыполненные рисунки не запускаем
+            executor.shutdown(wait=False, cancel_futures=True)
     
-    result = analyze_image_with_ai(image_data, name, description)
-    return jsonify(result)
+    response = Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+    # Пакет допускается целиком как один запрос: его параллелизм ограничен concurrency
+    if mode != 'fast':
+        started = admission.acquire()
+        response.call_on_close(lambda: admission.release(started))
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    image_data, name, description, options = read_analysis_request()
+    # Задание и так отдаёт результат позже, первый уровень здесь не нужен
+    options.pop('progressive')
+    
+    # Ставим анализ в очередь и сразу отдаём идентификатор задания
+    try:
+        job_id = job_manager.submit(analyze_image_with_ai, image_data, name, description, **options)
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'job_id': job_id, 'status': 'queued'}), 202, {'Location': f'/jobs/{job_id}'}
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return jsonify(job)
+
+@app.route('/analyses')
+def list_analyses():
+    # Постраничная история, новые первыми: следующая страница - ?before=<next>
+    try:
+        limit = min(max(int(request.args.get('limit', config.HISTORY_PAGE_SIZE)), 1), config.HISTORY_PAGE_MAX)
+    except ValueError:
+        return jsonify({'error': 'limit должен быть числом'}), 400
+    items = analysis_store.list(
+        before=request.args.get('before'),
+        limit=limit,
+        image_hash=request.args.get('image_hash'),
+    )
+    next_cursor = items[-1]['id'] if len(items) == limit else None
+    return jsonify({'items': items, 'next': next_cursor})
+
+@app.route('/analyses/<analysis_id>')
+def get_analysis(analysis_id):
+    analysis = analysis_store.get(analysis_id)
+    if analysis is None:
+        return jsonify({'error': 'Анализ не найден'}), 404
+    if analysis['has_thumbnail']:
+        analysis['thumbnail_url'] = f'/analyses/{analysis_id}/thumbnail'
+    return jsonify(analysis)
+
+@app.route('/analyses/<analysis_id>/thumbnail')
+def get_analysis_thumbnail(analysis_id):
+    thumbnail = analysis_store.thumbnail(analysis_id)
+    if thumbnail is None:
+        return jsonify({'error': 'Миниатюра не найдена'}), 404
+    data, mimetype = thumbnail
+    # Запись истории не меняется, миниатюру можно кэшировать навсегда
+    return Response(data, mimetype=mimetype, headers={'Cache-Control': 'public, max-age=31536000, immutable'})
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(dict(
+        result_cache.stats(),
+        singleflight=singleflight.stats(),
+        near_duplicates=near_index.stats(),
+    ))
+
+@app.route('/admission/stats')
+def admission_stats():
+    return jsonify(admission.stats())
+
+@app.route('/providers/stats')
+def provider_stats():
+    return jsonify(router.stats())
+
+@app.route('/ready')
+def ready():
+    # Проверка готовности для балансировщика: 200 только после прогрева
+    stats = preflight.stats()
+    return jsonify(stats), 200 if stats['ready'] else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+def static_response(static, cache_control):
+    # Сжатая копия по Accept-Encoding; при совпадении If-None-Match - 304 без тела
+    body, encoding, etag = static.select(request.accept_encodings)
+    response = Response(body, content_type=static.content_type)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    static = assets.get(filename)
+    if static is None:
+        return jsonify({'error': 'Файл не найден'}), 404
+    # Имя содержит хэш содержимого, так что файл не меняется никогда
+    return static_response(static, 'public, max-age=31536000, immutable')
 
 @app.route('/')
 def index():
-    return """
+    # Страница не кэшируется надолго: в ней адреса скриптов новой версии.
+    # Повторный визит проверяет ETag и получает 304
+    return static_response(index_page, 'no-cache')
+
+INDEX_HTML = """
 <!DOCTYPE html>
 <html lang="ru">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>НейроРНЖ - Анализ рисунков несуществующих животных</title>
-    <script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
-    <script src="https://polyfill.io/v3/polyfill.min.js?features=es6"></script>
-    <script id="MathJax-script" async src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js"></script>
+    <script defer src="{{marked}}"></script>
+    <script id="MathJax-script" async src="{{mathjax}}"></script>
     <style>
         :root {
             --primary-color: #e0f7fa;
@@ -235,6 +1053,11 @@ def index():
             font-weight: bold;
         }
         
+        label.option {
+            margin-top: 10px;
+            font-weight: normal;
+        }
+        
         #resultContainer {
             margin-top: 30px;
             padding: 20px;
@@ -325,6 +1148,7 @@ def index():
                 <div class="canvas-tools">
                     <button id="clearBtn">Очистить</button>
                     <button id="undoBtn">Отменить</button>
+                    <button id="redoBtn">Повторить</button>
                     <input type="color" id="colorPicker" value="#006064">
                     <input type="range" id="brushSize" min="1" max="20" value="5">
                     <button id="cameraBtn">Камера</button>
@@ -336,6 +1160,7 @@ def index():
                     <canvas id="drawingCanvas" width="500" height="400"></canvas>
                 </div>
                 <button id="analyzeBtn" style="width: 100%; padding: 12px;">Анализировать рисунок</button>
+                <label class="option"><input type="checkbox" id="sectionsMode"> Быстрее: разделы анализа готовятся параллельно</label>
             </section>
             
             <section class="info-section">
@@ -383,8 +1208,18 @@ def index():
             let isDrawing = false;
             let lastX = 0;
             let lastY = 0;
-            let drawingHistory = [];
-            let historyIndex = -1;
+            
+            // История рисунка - журнал операций вместо снимков холста: штрих хранит
+            // только точки, цвет и толщину. Координаты и толщина - в единицах листа
+            // SHEET_WIDTH x SHEET_HEIGHT, поэтому рисунок перерисовывается при любом
+            // размере холста и может уйти на сервер без растра.
+            // Операции: {type: 'stroke', color, width, points: [x0, y0, x1, y1, ...]},
+            // {type: 'clear'} и {type: 'image', image} - загруженное фото, заменяющее лист
+            const SHEET_WIDTH = 1000;
+            const SHEET_HEIGHT = 800;
+            let operations = [];
+            let undone = [];
+            let currentStroke = null;
             
             // Настройки рисования
             let currentColor = document.getElementById('colorPicker').value;
@@ -393,6 +1228,7 @@ def index():
             // Элементы интерфейса
             const clearBtn = document.getElementById('clearBtn');
             const undoBtn = document.getElementById('undoBtn');
+            const redoBtn = document.getElementById('redoBtn');
             const colorPicker = document.getElementById('colorPicker');
             const brushSize = document.getElementById('brushSize');
             const analyzeBtn = document.getElementById('analyzeBtn');
@@ -420,33 +1256,54 @@ def index():
                 redrawCanvas();
             }
             
-            // Перерисовка canvas из истории
-            function redrawCanvas() {
-                if (historyIndex >= 0 && historyIndex < drawingHistory.length) {
-                    const image = new Image();
-                    image.onload = function() {
-                        ctx.clearRect(0, 0, canvas.width, canvas.height);
-                        ctx.drawImage(image, 0, 0, canvas.width, canvas.height);
-                    };
-                    image.src = drawingHistory[historyIndex];
-                } else {
-                    ctx.clearRect(0, 0, canvas.width, canvas.height);
-                }
+            // Операции после последней очистки или загрузки фото - то, что сейчас на листе
+            function visibleOperations() {
+                let start = 0;
+                operations.forEach(function(operation, index) {
+                    if (operation.type === 'clear') {
+                        start = index + 1;
+                    } else if (operation.type === 'image') {
+                        start = index;
+                    }
+                });
+                return operations.slice(start);
             }
             
-            // Сохранение состояния canvas
-            function saveCanvasState() {
-                if (historyIndex < drawingHistory.length - 1) {
-                    drawingHistory = drawingHistory.slice(0, historyIndex + 1);
+            function strokePath(stroke) {
+                const scale = canvas.width / SHEET_WIDTH;
+                const points = stroke.points;
+                ctx.beginPath();
+                ctx.moveTo(points[0] * scale, points[1] * scale);
+                // Касание без движения рисуется точкой: отрезок нулевой длины с круглыми концами
+                if (points.length === 2) {
+                    ctx.lineTo(points[0] * scale, points[1] * scale);
                 }
-                
-                drawingHistory.push(canvas.toDataURL());
-                historyIndex = drawingHistory.length - 1;
-                
-                if (drawingHistory.length > 20) {
-                    drawingHistory.shift();
-                    historyIndex--;
+                for (let i = 2; i < points.length; i += 2) {
+                    ctx.lineTo(points[i] * scale, points[i + 1] * scale);
                 }
+                ctx.strokeStyle = stroke.color;
+                ctx.lineWidth = stroke.width * scale;
+                ctx.lineCap = 'round';
+                ctx.lineJoin = 'round';
+                ctx.stroke();
+            }
+            
+            // Перерисовка canvas по журналу операций
+            function redrawCanvas() {
+                ctx.clearRect(0, 0, canvas.width, canvas.height);
+                visibleOperations().forEach(function(operation) {
+                    if (operation.type === 'image') {
+                        ctx.drawImage(operation.image, 0, 0, canvas.width, canvas.height);
+                    } else {
+                        strokePath(operation);
+                    }
+                });
+            }
+            
+            // Новая операция отменяет возможность повторить отменённые
+            function pushOperation(operation) {
+                operations.push(operation);
+                undone = [];
             }
             
             // Обработчики событий для рисования
@@ -458,11 +1315,23 @@ def index():
             canvas.addEventListener('touchend', stopDrawing);
             canvas.addEventListener('mouseout', stopDrawing);
             
+            function toSheet(pos) {
+                const scale = SHEET_WIDTH / canvas.width;
+                return [Math.round(pos.x * scale), Math.round(pos.y * scale)];
+            }
+            
             function startDrawing(e) {
                 isDrawing = true;
                 const pos = getPosition(e);
                 [lastX, lastY] = [pos.x, pos.y];
-                saveCanvasState();
+                currentStroke = {
+                    type: 'stroke',
+                    color: currentColor,
+                    width: Math.round(currentBrushSize * SHEET_WIDTH / canvas.width * 10) / 10,
+                    points: toSheet(pos)
+                };
+                pushOperation(currentStroke);
+                strokePath(currentStroke);
             }
             
             function handleTouchStart(e) {
@@ -479,6 +1348,7 @@ def index():
                 if (!isDrawing) return;
                 
                 const pos = getPosition(e);
+                currentStroke.points.push(...toSheet(pos));
                 
                 ctx.beginPath();
                 ctx.moveTo(lastX, lastY);
@@ -504,6 +1374,7 @@ def index():
             
             function stopDrawing() {
                 isDrawing = false;
+                currentStroke = null;
             }
             
             function getPosition(e) {
@@ -517,14 +1388,21 @@ def index():
             // Обработчики кнопок
             clearBtn.addEventListener('click', function() {
                 if (confirm('Вы уверены, что хотите очистить холст?')) {
-                    saveCanvasState();
-                    ctx.clearRect(0, 0, canvas.width, canvas.height);
+                    pushOperation({type: 'clear'});
+                    redrawCanvas();
                 }
             });
             
             undoBtn.addEventListener('click', function() {
-                if (historyIndex > 0) {
-                    historyIndex--;
+                if (operations.length) {
+                    undone.push(operations.pop());
+                    redrawCanvas();
+                }
+            });
+            
+            redoBtn.addEventListener('click', function() {
+                if (undone.length) {
+                    operations.push(undone.pop());
                     redrawCanvas();
                 }
             });
@@ -549,12 +1427,10 @@ def index():
                     reader.onload = function(event) {
                         const img = new Image();
                         img.onload = function() {
-                            // Сохраняем текущее состояние
-                            saveCanvasState();
-                            
-                            // Очищаем холст и рисуем новое изображение
-                            ctx.clearRect(0, 0, canvas.width, canvas.height);
-                            ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
+                            // Изображение заменяет рисунок: в журнале хранится само
+                            // декодированное изображение, а не его копия в data URL
+                            pushOperation({type: 'image', image: img});
+                            redrawCanvas();
                         };
                         img.src = event.target.result;
                     };
@@ -596,9 +1472,8 @@ def index():
                     // Сохраняем снимок на основном холсте
                     const img = new Image();
                     img.onload = function() {
-                        saveCanvasState();
-                        ctx.clearRect(0, 0, canvas.width, canvas.height);
-                        ctx.drawImage(img, 0, 0, canvas.width, canvas.height);
+                        pushOperation({type: 'image', image: img});
+                        redrawCanvas();
                     };
                     img.src = cameraCanvas.toDataURL();
                 }
@@ -614,12 +1489,11 @@ def index():
             
             // Сохранение изображения (для использования в программе)
             saveImageBtn.addEventListener('click', function() {
-                saveCanvasState();
                 alert("Изображение сохранено для анализа!");
             });
             
-            // Анализ рисунка
-            analyzeBtn.addEventListener('click', function() {
+            // Анализ рисунка; force - не брать сохранённый анализ похожего рисунка
+            function runAnalysis(force) {
                 const name = document.getElementById('animalName').value.trim();
                 const description = document.getElementById('animalDescription').value.trim();
                 
@@ -628,8 +1502,8 @@ def index():
                     return;
                 }
                 
-                const isEmpty = !canvas.toDataURL().replace(canvas.toDataURL('image/png', 0.1).split(',')[1], '');
-                if (isEmpty) {
+                const visible = visibleOperations();
+                if (!visible.length) {
                     alert('Пожалуйста, нарисуйте или загрузите животное перед анализом');
                     return;
                 }
@@ -637,26 +1511,78 @@ def index():
                 loadingIndicator.style.display = 'block';
                 resultContainer.style.display = 'none';
                 
-                // Отправка данных на сервер
-                fetch('/analyze', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({
-                        image: canvas.toDataURL(),
-                        name: name,
-                        description: description
-                    })
-                })
-                .then(response => response.json())
-                .then(data => {
+                // Отправка данных на сервер: ответ приходит потоком Server-Sent Events
+                let analysisText = '';
+                let renderScheduled = false;
+                // Режим по разделам: готовые разделы показываются на своих местах
+                const sections = [];
+                
+                // Частичный markdown перерисовываем не чаще одного раза за кадр
+                function renderPartial() {
+                    if (renderScheduled) return;
+                    renderScheduled = true;
+                    requestAnimationFrame(function() {
+                        renderScheduled = false;
+                        analysisResult.innerHTML = marked.parse(analysisText);
+                    });
+                }
+                
+                function handleEvent(event, data) {
+                    if (event === 'features') {
+                        // Измеренные признаки рисунка; придут и в итоговом 'done'
+                    } else if (event === 'summary') {
+                        // Краткий локальный анализ виден, пока модель готовит подробный;
+                        // первый же фрагмент подробного анализа заменяет его
+                        loadingIndicator.style.display = 'none';
+                        analysisResult.innerHTML = marked.parse(data.analysis) +
+                            '<p><em>Подробный анализ готовится…</em></p>';
+                        resultContainer.style.display = 'block';
+                    } else if (event === 'delta') {
+                        if (!analysisText) {
+                            loadingIndicator.style.display = 'none';
+                            resultContainer.style.display = 'block';
+                        }
+                        analysisText += data.delta;
+                        renderPartial();
+                    } else if (event === 'section') {
+                        if (!sections.some(Boolean)) {
+                            loadingIndicator.style.display = 'none';
+                            resultContainer.style.display = 'block';
+                        }
+                        sections[data.index] = '## ' + data.title + '\\n\\n' + (data.content || '_Раздел не получен_');
+                        analysisText = sections.filter(Boolean).join('\\n\\n');
+                        renderPartial();
+                    } else {
+                        // 'done' или 'error'
+                        showResult(data);
+                    }
+                }
+                
+                function showResult(data) {
                     loadingIndicator.style.display = 'none';
                     
                     if (data.error) {
                         analysisResult.innerHTML = `<p>${data.error}</p>`;
                     } else {
                         analysisResult.innerHTML = marked.parse(data.analysis);
+                        
+                        // Показан сохранённый анализ почти такого же рисунка
+                        if (data.approximate) {
+                            const notice = document.createElement('p');
+                            notice.textContent = 'Рисунок почти совпадает с уже проанализированным, показан сохранённый анализ. ';
+                            const rerunBtn = document.createElement('button');
+                            rerunBtn.textContent = 'Проанализировать заново';
+                            rerunBtn.addEventListener('click', function() {
+                                runAnalysis(true);
+                            });
+                            notice.appendChild(rerunBtn);
+                            analysisResult.prepend(notice);
+                        }
+                        
+                        // Ссылка на сохранённый анализ: после перезагрузки он откроется снова
+                        if (data.id) {
+                            history.replaceState(null, '', '?analysis=' + encodeURIComponent(data.id));
+                        }
                     }
                     
                     resultContainer.style.display = 'block';
@@ -664,23 +1590,121 @@ def index():
                     if (window.MathJax) {
                         MathJax.typesetPromise();
                     }
+                }
+                
+                function parseEvents(buffer) {
+                    const blocks = buffer.split('\\n\\n');
+                    const rest = blocks.pop();
+                    blocks.forEach(function(block) {
+                        let event = 'message';
+                        let data = '';
+                        block.split('\\n').forEach(function(line) {
+                            if (line.startsWith('event: ')) event = line.slice(7);
+                            else if (line.startsWith('data: ')) data += line.slice(6);
+                        });
+                        if (data) handleEvent(event, JSON.parse(data));
+                    });
+                    return rest;
+                }
+                
+                // Нарисованное от руки уходит журналом штрихов, растр строит сервер;
+                // загруженное фото - двоичным файлом в multipart-форме, без base64
+                const hasImage = visible.some(operation => operation.type === 'image');
+                const drawing = hasImage
+                    ? new Promise(resolve => canvas.toBlob(resolve, 'image/png'))
+                    : Promise.resolve(null);
+                drawing
+                .then(blob => {
+                    const form = new FormData();
+                    if (blob) {
+                        form.append('image', blob, 'animal.png');
+                    } else {
+                        form.append('strokes', JSON.stringify({
+                            size: [SHEET_WIDTH, SHEET_HEIGHT],
+                            strokes: visible.map(stroke => ({
+                                color: stroke.color, width: stroke.width, points: stroke.points
+                            }))
+                        }));
+                    }
+                    form.append('name', name);
+                    form.append('description', description);
+                    if (force) {
+                        form.append('force', '1');
+                    }
+                    if (document.getElementById('sectionsMode').checked) {
+                        form.append('mode', 'sections');
+                    }
+                    form.append('progressive', '1');
+                    return fetch('/analyze/stream', {
+                        method: 'POST',
+                        body: form
+                    });
+                })
+                .then(response => {
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+                    
+                    function pump() {
+                        return reader.read().then(function(chunk) {
+                            if (chunk.done) {
+                                parseEvents(buffer + '\\n\\n');
+                                return;
+                            }
+                            buffer = parseEvents(buffer + decoder.decode(chunk.value, { stream: true }));
+                            return pump();
+                        });
+                    }
+                    return pump();
                 })
                 .catch(error => {
                     loadingIndicator.style.display = 'none';
                     analysisResult.innerHTML = `<p>Ошибка при анализе: ${error.message}</p>`;
                     resultContainer.style.display = 'block';
                 });
+            }
+            
+            analyzeBtn.addEventListener('click', function() {
+                runAnalysis(false);
             });
             
+            // Анализ из ссылки ?analysis=<id> загружается из истории
+            function loadSavedAnalysis() {
+                const analysisId = new URLSearchParams(location.search).get('analysis');
+                if (!analysisId) return;
+                fetch('/analyses/' + encodeURIComponent(analysisId))
+                .then(response => response.json())
+                .then(data => {
+                    if (data.error) return;
+                    document.getElementById('animalName').value = data.name;
+                    document.getElementById('animalDescription').value = data.description;
+                    analysisResult.innerHTML = marked.parse(data.analysis);
+                    resultContainer.style.display = 'block';
+                    if (window.MathJax) {
+                        MathJax.typesetPromise();
+                    }
+                });
+            }
+            
             // Инициализация
             resizeCanvas();
             window.addEventListener('resize', resizeCanvas);
-            saveCanvasState();
+            loadSavedAnalysis();
         });
     </script>
 </body>
 </html>
 """
 
+# Адреса скриптов подставляются, а копии сжимаются один раз на процесс
+index_page = StaticFile(
+    INDEX_HTML.replace('{{marked}}', assets.url('marked')).replace('{{mathjax}}', assets.url('mathjax')).encode(),
+    'text/html; charset=utf-8',
+)
+
+# Прогрев запускается, когда собрана и главная страница: её сжатие - тоже его шаг
+preflight.start()
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Сервер разработки; для production см. wsgi.py и gunicorn.conf.py
+    app.run(debug=bool(config.DEBUG), threaded=True)
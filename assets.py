@@ -0,0 +1,149 @@
+"""Статика страницы из памяти: сжатые копии, сильные ETag и адреса по хэшу содержимого.
+
+Сторонние скрипты лежат в static/vendor и коммитятся вместе с кодом; пока файла
+нет, страница берёт его с CDN. Недостающие скачиваются и проверяются командами
+
+    python -m assets
+    python -m assets --check
+"""
+import argparse
+import gzip
+import hashlib
+import logging
+import os
+import sys
+import threading
+import urllib.request
+
+try:
+    import brotli
+except ImportError:  # без brotli отдаём только gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+VENDOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'vendor')
+
+# Сторонние скрипты страницы: имя -> (файл в static/vendor, откуда скачать).
+# MathJax в варианте SVG: ему не нужны отдельные файлы шрифтов
+VENDOR = {
+    'marked': ('marked.min.js', 'https://cdn.jsdelivr.net/npm/marked@12.0.2/marked.min.js'),
+    'mathjax': ('tex-svg.js', 'https://cdn.jsdelivr.net/npm/mathjax@3.2.2/es5/tex-svg.js'),
+}
+
+CONTENT_TYPES = {
+    '.js': 'text/javascript; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.html': 'text/html; charset=utf-8',
+}
+
+# brotli с максимальным качеством сжимает мегабайт несколько секунд,
+# поэтому большие файлы сжимаются чуть слабее
+BROTLI_MAX_QUALITY_BYTES = 256 * 1024
+
+
+class StaticFile:
+    """Неизменяемое содержимое со сжатыми копиями, которые готовятся один раз."""
+
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self._encoded = None
+        self._lock = threading.Lock()
+
+    def encoded(self):
+        # Сжимаем при первом обращении (или при прогреве), а не при импорте
+        with self._lock:
+            if self._encoded is None:
+                encoded = {'gzip': gzip.compress(self.body, 9, mtime=0)}
+                if brotli is not None:
+                    quality = 11 if len(self.body) <= BROTLI_MAX_QUALITY_BYTES else 9
+                    encoded['br'] = brotli.compress(self.body, quality=quality)
+                self._encoded = {name: data for name, data in encoded.items() if len(data) < len(self.body)}
+            return self._encoded
+
+    def select(self, accept_encodings):
+        # (тело, Content-Encoding или None, ETag); у каждой кодировки свой ETag,
+        # как требуется для сильного валидатора
+        encoded = self.encoded()
+        for encoding in ('br', 'gzip'):
+            if encoding in encoded and accept_encodings[encoding]:
+                return encoded[encoding], encoding, f'{self.etag}-{encoding}'
+        return self.body, None, self.etag
+
+
+class Assets:
+    """Файлы static/vendor по адресам вида /assets/<имя>.<хэш>.<расширение>.
+
+    Адрес меняется вместе с содержимым, поэтому файлы можно кэшировать навсегда.
+    Если файла нет, страница ссылается на тот же закреплённый файл на CDN
+    (скрипты подключаются с defer/async и не блокируют отрисовку).
+    """
+
+    def __init__(self, directory=VENDOR_DIR, prefix='/assets/'):
+        self._files = {}
+        self._urls = {}
+        for name, (filename, url) in VENDOR.items():
+            path = os.path.join(directory, filename)
+            try:
+                with open(path, 'rb') as f:
+                    body = f.read()
+            except FileNotFoundError:
+                logger.warning('Нет файла %s, страница загрузит его с %s (скачать: python -m assets)', path, url)
+                self._urls[name] = url
+                continue
+            static = StaticFile(body, content_type(filename))
+            stem, extension = os.path.splitext(filename)
+            hashed = f'{stem}.{static.etag[:12]}{extension}'
+            self._files[hashed] = static
+            self._urls[name] = prefix + hashed
+
+    def url(self, name):
+        return self._urls[name]
+
+    def get(self, filename):
+        return self._files.get(filename)
+
+    def warm_up(self):
+        for static in self._files.values():
+            static.encoded()
+
+
+def content_type(filename):
+    return CONTENT_TYPES.get(os.path.splitext(filename)[1], 'application/octet-stream')
+
+
+def missing(directory=VENDOR_DIR):
+    return [filename for filename, _ in VENDOR.values() if not os.path.exists(os.path.join(directory, filename))]
+
+
+def fetch(directory=VENDOR_DIR):
+    # Скачивает недостающие файлы; после этого static/vendor стоит закоммитить
+    os.makedirs(directory, exist_ok=True)
+    for filename, url in VENDOR.values():
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            continue
+        with urllib.request.urlopen(url, timeout=60) as response:
+            data = response.read()
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        print(f'{filename}: {len(data)} байт из {url}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='только проверить, что все файлы на месте')
+    args = parser.parse_args()
+    if not args.check:
+        fetch()
+    absent = missing()
+    if absent:
+        print(f'Нет файлов в {VENDOR_DIR}: {", ".join(absent)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
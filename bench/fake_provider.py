@@ -0,0 +1,87 @@
+import math
+import os
+import random
+import time
+
+from g4f.providers.base_provider import AbstractProvider
+
+ANSWER = (
+    '## Анализ\n\n'
+    'Ответ локального тестового провайдера. '
+    'Рисунок расположен по центру листа, детали проработаны умеренно. '
+    'Название нейтральное, описание соответствует рисунку.'
+)
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+class FakeProvider(AbstractProvider):
+    """Локальный провайдер g4f для замеров: отвечает через заданную паузу без сети.
+
+    Подключается так: NEURO_PROVIDERS=bench.fake_provider:FakeProvider
+
+    Поведение задаётся переменными окружения:
+    FAKE_PROVIDER_LATENCY - средняя задержка ответа в секундах;
+    FAKE_PROVIDER_DISTRIBUTION - fixed, uniform (от 0 до 2x среднего) или lognormal;
+    FAKE_PROVIDER_SIGMA - разброс логнормального распределения;
+    FAKE_PROVIDER_ERROR_RATE - доля запросов, завершающихся ошибкой;
+    FAKE_PROVIDER_FIRST_CHUNK - доля задержки до первого фрагмента при потоковой выдаче;
+    FAKE_PROVIDER_CHUNKS - на сколько фрагментов делится ответ;
+    FAKE_PROVIDER_SEED - зерно генератора для воспроизводимых прогонов.
+
+    Как и сетевые провайдеры g4f, соблюдает переданный timeout.
+    """
+
+    working = True
+    supports_stream = True
+    latency = _env_float('FAKE_PROVIDER_LATENCY', 2.0)
+    distribution = os.environ.get('FAKE_PROVIDER_DISTRIBUTION') or 'fixed'
+    sigma = _env_float('FAKE_PROVIDER_SIGMA', 0.5)
+    error_rate = _env_float('FAKE_PROVIDER_ERROR_RATE', 0.0)
+    first_chunk = _env_float('FAKE_PROVIDER_FIRST_CHUNK', 0.3)
+    chunks = int(_env_float('FAKE_PROVIDER_CHUNKS', 20))
+    rng = random.Random(os.environ.get('FAKE_PROVIDER_SEED'))
+
+    @classmethod
+    def sample_latency(cls):
+        if cls.distribution == 'uniform':
+            return cls.rng.uniform(0, 2 * cls.latency)
+        if cls.distribution == 'lognormal':
+            # Медиана подобрана так, чтобы среднее совпадало с FAKE_PROVIDER_LATENCY
+            return cls.rng.lognormvariate(0, cls.sigma) * cls.latency / math.exp(cls.sigma ** 2 / 2)
+        return cls.latency
+
+    @classmethod
+    def create_completion(cls, model, messages, stream=False, timeout=None, **kwargs):
+        latency = cls.sample_latency()
+        failed = cls.rng.random() < cls.error_rate
+        started = time.monotonic()
+
+        def pause(seconds):
+            # Пауза, не выходящая за timeout: как у сетевого провайдера, ответ обрывается
+            if timeout is not None and time.monotonic() - started + seconds > timeout:
+                time.sleep(max(0, timeout - (time.monotonic() - started)))
+                raise TimeoutError('Тестовый провайдер: истёк timeout')
+            time.sleep(seconds)
+
+        if not stream:
+            pause(latency)
+            if failed:
+                raise RuntimeError('Тестовый провайдер: имитация ошибки')
+            yield ANSWER
+            return
+
+        # Потоковая выдача: пауза до первого фрагмента, остальные равномерно до конца
+        pause(latency * cls.first_chunk)
+        if failed:
+            raise RuntimeError('Тестовый провайдер: имитация ошибки')
+        count = max(1, cls.chunks)
+        size = -(-len(ANSWER) // count)
+        interval = latency * (1 - cls.first_chunk) / count
+        for start in range(0, len(ANSWER), size):
+            if start:
+                pause(interval)
+            yield ANSWER[start:start + size]
@@ -0,0 +1,58 @@
+import base64
+import random
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def sample_drawing(seed=0):
+    # Небольшой рисунок на прозрачном холсте, как его отправляет страница
+    image = Image.new('RGBA', (500, 400), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((150 + seed % 50, 100, 350, 300), outline='#006064', width=5)
+    draw.line((200, 300, 180, 380), fill='#006064', width=5)
+    buffer = BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue(), 'image/png'
+
+
+def sample_photo(seed=0, size=(4032, 3024)):
+    # Фотография рисунка на бумаге с камеры телефона: неровное освещение, шум
+    # сенсора и JPEG высокого качества - несколько мегабайт, как в жизни
+    rng = np.random.default_rng(seed)
+    width, height = size
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    light = 200 + 40 * x - 30 * y
+    noise = rng.normal(0, 6, (height, width)).astype(np.float32)
+    paper = np.clip(light + noise, 0, 255).astype(np.uint8)
+    image = Image.merge('RGB', [
+        Image.fromarray(paper),
+        Image.fromarray(np.clip(paper.astype(np.int16) - 4, 0, 255).astype(np.uint8)),
+        Image.fromarray(np.clip(paper.astype(np.int16) - 12, 0, 255).astype(np.uint8)),
+    ])
+
+    draw = ImageDraw.Draw(image)
+    shapes = random.Random(seed)
+    cx, cy = width // 2 + shapes.randint(-400, 400), height // 2 + shapes.randint(-300, 300)
+    draw.ellipse((cx - 700, cy - 500, cx + 700, cy + 500), outline=(40, 40, 60), width=14)
+    for _ in range(12):
+        x0, y0 = cx + shapes.randint(-900, 900), cy + shapes.randint(-700, 700)
+        draw.line((x0, y0, x0 + shapes.randint(-300, 300), y0 + shapes.randint(-300, 300)),
+                  fill=(40, 40, 60), width=10)
+    image = image.filter(ImageFilter.GaussianBlur(1.2))
+
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue(), 'image/jpeg'
+
+
+KINDS = {
+    'sketch': sample_drawing,
+    'photo': sample_photo,
+}
+
+
+def data_url(data, mimetype):
+    return f'data:{mimetype};base64,' + base64.b64encode(data).decode()
@@ -0,0 +1,136 @@
+"""Замер холодного запуска процесса: импорт app, первый ответ и прогрев.
+
+Каждый прогон - отдельный интерпретатор, как новый процесс-обработчик gunicorn:
+
+    NEURO_PROVIDERS=bench.fake_provider:FakeProvider python -m bench.startup --runs 5
+
+Показатели: import_s - время импорта app (с него процесс принимает запросы),
+first_response_s - до ответа на первый GET /, ready_s - до готовности к анализу
+(/ready). Отчёт перечисляет тяжёлые модули, загруженные уже при импорте, и самые
+медленные импорты по -X importtime. Как и bench.throughput, отчёт сохраняется
+(--output) и сравнивается с прошлым (--compare); при регрессии код выхода 1.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from bench.throughput import compare, environment
+
+# Модули, которые не должны загружаться при импорте app
+HEAVY_MODULES = ['g4f', 'PIL.Image', 'numpy']
+COMPARED = [('import_s_p50', False), ('first_response_s_p50', False), ('ready_s_p50', False)]
+
+# Выполняется в отдельном интерпретаторе; печатает JSON с замерами
+# Прогрев запускается вручную после первого ответа: так замер импорта не зависит
+# от того, что фоновый поток успел загрузить, а ready_s - оценка сверху
+PROBE = r'''
+import importlib.util, json, sys, time
+import warmup
+start_preflight = warmup.Preflight.start
+warmup.Preflight.start = lambda self: None
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+eager = [name for name in HEAVY if name in sys.modules
+         and not isinstance(sys.modules[name], importlib.util._LazyModule)]
+loaded = set(sys.modules)
+status = app.app.test_client().get('/').status_code
+responded = time.perf_counter()
+start_preflight(app.preflight)
+ready = app.preflight.wait(TIMEOUT)
+warm = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - started,
+    'first_response_s': responded - started,
+    'ready_s': warm - started if ready else None,
+    'index_status': status,
+    'eager_heavy_modules': eager,
+    'loaded_at_import': sorted(loaded),
+    'preflight': app.preflight.stats(),
+}))
+'''
+
+
+def parse_importtime(text, modules):
+    # Строки "import time: self | cumulative | name" -> {имя: собственное время, с}
+    costs = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        if name in modules:
+            costs[name] = int(parts[0]) / 1_000_000
+    return costs
+
+
+def probe(timeout):
+    # Своя база истории для каждого прогона, чтобы не трогать рабочую
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, NEURO_STORE_PATH=os.path.join(directory, 'analyses.db'))
+        code = f'HEAVY = {HEAVY_MODULES!r}\nTIMEOUT = {timeout!r}\n' + PROBE
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True, text=True, env=env, timeout=timeout + 60,
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr else 'probe failed')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    # Импорты прогрева в отчёт о запуске не входят
+    result['import_costs'] = parse_importtime(completed.stderr, set(result.pop('loaded_at_import')))
+    return result
+
+
+def run(runs, timeout, top=10):
+    results = [probe(timeout) for _ in range(runs)]
+    report = {'runs': runs}
+    for key in ('import_s', 'first_response_s', 'ready_s'):
+        values = [result[key] for result in results if result[key] is not None]
+        report[key + '_p50'] = round(statistics.median(values), 3) if values else None
+        report[key + '_max'] = round(max(values), 3) if values else None
+    report['not_ready'] = sum(1 for result in results if result['ready_s'] is None)
+    report['eager_heavy_modules'] = sorted({name for result in results for name in result['eager_heavy_modules']})
+    # Самые медленные импорты по медиане собственного времени
+    names = {name for result in results for name in result['import_costs']}
+    costs = {name: statistics.median(result['import_costs'].get(name, 0) for result in results) for name in names}
+    report['slowest_imports_ms'] = {
+        name: round(cost * 1000, 1) for name, cost in sorted(costs.items(), key=lambda item: -item[1])[:top]
+    }
+    report['preflight'] = results[-1]['preflight']
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60, help='сколько ждать готовности, с')
+    parser.add_argument('--top', type=int, default=10, help='сколько медленных импортов показать')
+    parser.add_argument('--output', help='сохранить отчёт в JSON-файл')
+    parser.add_argument('--compare', help='JSON-отчёт прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение, доля')
+    args = parser.parse_args()
+
+    report = run(args.runs, args.timeout, args.top)
+    report['environment'] = environment()
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['comparison'] = compare(report, json.load(f), args.tolerance, COMPARED)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    # Тяжёлый модуль при импорте - тоже регрессия: процесс снова запускается медленно
+    if report.get('comparison', {}).get('regressions') or report['eager_heavy_modules']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""Замер пропускной способности /analyze.
+
+Пример сравнения режимов запуска (провайдер - bench.fake_provider с паузой 2 с):
+
+    NEURO_PROVIDERS=bench.fake_provider:FakeProvider NEURO_DEBUG=0 python app.py
+    python -m bench.throughput --url http://127.0.0.1:5000/analyze
+
+    NEURO_PROVIDERS=bench.fake_provider:FakeProvider gunicorn -c gunicorn.conf.py wsgi:app
+    python -m bench.throughput --url http://127.0.0.1:8000/analyze
+
+Смесь нагрузки задаётся долями видов рисунков (--mix sketch=0.8,photo=0.2).
+Результат можно сохранить (--output) и сравнить с прошлым прогоном (--compare):
+при падении RPS или росте p95 больше допуска команда завершается с кодом 1.
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+from bench.payloads import KINDS, data_url
+
+# Показатели для сравнения с базовым прогоном: (ключ, чем больше - тем лучше)
+COMPARED = [('rps', True), ('p50_s', False), ('p95_s', False), ('p99_s', False)]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, share = part.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise argparse.ArgumentTypeError(f'Неизвестный вид рисунка: {kind}')
+        mix[kind] = float(share or 1)
+    return mix
+
+
+def build_body(payload, name, multipart):
+    data, mimetype = payload
+    fields = {'name': name, 'description': 'Тестовое описание'}
+    if not multipart:
+        body = json.dumps(dict(fields, image=data_url(data, mimetype))).encode()
+        return body, 'application/json'
+
+    # multipart/form-data, как отправляет страница
+    boundary = uuid.uuid4().hex
+    parts = []
+    for key, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="image"\r\n'
+        f'Content-Type: {mimetype}\r\n\r\n'.encode() + data + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def metrics_url(url):
+    parts = urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, '/metrics', '', ''))
+
+
+def server_memory(url):
+    # Память сервера из его /metrics; None, если эндпоинт недоступен
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            text = response.read().decode()
+    except Exception:
+        return None
+    memory = {}
+    for key, metric in (('rss_bytes', 'process_resident_memory_bytes'),
+                        ('max_rss_bytes', 'process_max_resident_memory_bytes')):
+        match = re.search(rf'^{metric} (\S+)$', text, re.M)
+        if match:
+            memory[key] = int(float(match.group(1)))
+    return memory or None
+
+
+def summarize(latencies, first_bytes):
+    if not latencies:
+        return {}
+    return {
+        'p50_s': round(percentile(latencies, 0.5), 3),
+        'p95_s': round(percentile(latencies, 0.95), 3),
+        'p99_s': round(percentile(latencies, 0.99), 3),
+        'ttfb_p50_s': round(percentile(first_bytes, 0.5), 3),
+        'ttfb_p95_s': round(percentile(first_bytes, 0.95), 3),
+    }
+
+
+def run(url, concurrency, total, mix=None, multipart=False, seed=0, warmup=0):
+    mix = mix or {'sketch': 1.0}
+    # Рисунки и порядок их отправки готовим заранее и детерминированно, чтобы
+    # прогоны были сравнимы, а генератор нагрузки не отнимал процессор у сервера
+    rng = random.Random(seed)
+    payloads = {kind: [KINDS[kind](seed + variant) for variant in range(4)] for kind in mix}
+    kinds = list(mix)
+    schedule = rng.choices(kinds, weights=[mix[kind] for kind in kinds], k=warmup + total)
+    run_id = uuid.uuid4().hex[:8]
+
+    latencies = {kind: [] for kind in kinds}
+    first_bytes = {kind: [] for kind in kinds}
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(warmup, warmup + total))
+
+    def send(index):
+        kind = schedule[index]
+        # Разные названия, чтобы кэш результатов не подменял замер
+        body, content_type = build_body(
+            payloads[kind][index % len(payloads[kind])], f'Зверь {run_id} {index}', multipart,
+        )
+        request = urllib.request.Request(url, body, {'Content-Type': content_type})
+        start = time.perf_counter()
+        with urllib.request.urlopen(request, timeout=300) as response:
+            response.read(1)
+            first_byte = time.perf_counter() - start
+            response.read()
+        return kind, time.perf_counter() - start, first_byte
+
+    def worker():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            try:
+                kind, latency, first_byte = send(index)
+            except Exception as e:
+                with lock:
+                    errors.append(type(e).__name__)
+                continue
+            with lock:
+                latencies[kind].append(latency)
+                first_bytes[kind].append(first_byte)
+
+    memory_before = server_memory(metrics_url(url))
+    if warmup:
+        # Прогрев по одному запросу: пулы клиентов и ленивые импорты сервера
+        for index in range(warmup):
+            try:
+                send(index)
+            except Exception:
+                pass
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    all_first_bytes = [value for values in first_bytes.values() for value in values]
+    report = {
+        'url': url,
+        'concurrency': concurrency,
+        'requests': total,
+        'mix': mix,
+        'multipart': multipart,
+        'seed': seed,
+        'errors': len(errors),
+        'error_types': {name: errors.count(name) for name in sorted(set(errors))},
+        'elapsed_s': round(elapsed, 2),
+        'rps': round(len(all_latencies) / elapsed, 2),
+    }
+    report.update(summarize(all_latencies, all_first_bytes))
+    report['by_kind'] = {
+        kind: dict(requests=len(latencies[kind]), **summarize(latencies[kind], first_bytes[kind]))
+        for kind in kinds
+    }
+    report['server_memory'] = {'before': memory_before, 'after': server_memory(metrics_url(url))}
+    return report
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def compare(report, baseline, tolerance, compared=COMPARED):
+    # Относительные изменения показателей; регрессия - ухудшение больше допуска
+    changes = {}
+    regressions = []
+    for key, higher_is_better in compared:
+        old, new = baseline.get(key), report.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        changes[key] = round(change, 3)
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(key)
+    return {'changes': changes, 'regressions': regressions, 'tolerance': tolerance}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000/analyze')
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=256)
+    parser.add_argument('--mix', type=parse_mix, default={'sketch': 1.0},
+                        help='доли видов рисунков, например sketch=0.8,photo=0.2')
+    parser.add_argument('--multipart', action='store_true', help='отправлять файлом, как страница')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--warmup', type=int, default=0, help='запросы до начала замера')
+    parser.add_argument('--output', help='сохранить отчёт в JSON-файл')
+    parser.add_argument('--compare', help='JSON-отчёт прошлого прогона для сравнения')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='допустимое ухудшение, доля')
+    args = parser.parse_args()
+
+    report = run(args.url, args.concurrency, args.requests, args.mix, args.multipart, args.seed, args.warmup)
+    report['environment'] = environment()
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            report['comparison'] = compare(report, json.load(f), args.tolerance)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    if report.get('comparison', {}).get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
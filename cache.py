@@ -0,0 +1,302 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Как часто перечитывать каталог дискового уровня: в нём могут писать и другие
+# процессы gunicorn, чьих записей нет в индексе этого процесса
+DISK_RESCAN_INTERVAL = 600
+
+
+def make_key(image_bytes, name, description, variant=''):
+    # Ключ по содержимому: хэш декодированного изображения, названия и описания;
+    # variant различает результаты разных режимов анализа одного рисунка
+    digest = hashlib.sha256()
+    parts = [image_bytes, name.encode('utf-8'), description.encode('utf-8')]
+    if variant:
+        parts.append(variant.encode('utf-8'))
+    for part in parts:
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Двухуровневый кэш результатов: LRU в памяти и необязательный каталог на диске.
+
+    on_evict(ключ) вызывается, когда запись покидает кэш совсем: при вытеснении
+    или истечении на диске, а без дискового уровня - в памяти.
+
+    Размер и порядок файлов на диске ведутся в памяти: запись не перечитывает
+    каталог, он сканируется при запуске и раз в DISK_RESCAN_INTERVAL секунд.
+    """
+
+    def __init__(self, memory_size=256, directory=None, ttl=None, disk_max_bytes=None, on_evict=None):
+        self.memory_size = memory_size
+        self.directory = directory or None
+        self.ttl = ttl
+        self.disk_max_bytes = disk_max_bytes
+        self.on_evict = on_evict
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
+        # Индекс дискового уровня: ключ -> (mtime, размер), старые записи первыми
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_scanned = 0.0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._disk_scan()
+
+    def get(self, key):
+        now = time.time()
+        evicted = []
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if not self._expired(stored_at, now):
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return value
+                del self._memory[key]
+                if not self.directory:
+                    evicted.append(key)
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self._counters['misses'] += 1
+            else:
+                self._counters['disk_hits'] += 1
+                evicted += self._memory_put(key, value, now)
+        self._notify(evicted)
+        return value
+
+    def set(self, key, value, meta=None):
+        # meta - данные для восстановления индексов после перезапуска (см. entries())
+        now = time.time()
+        with self._lock:
+            evicted = self._memory_put(key, value, now)
+            self._counters['stores'] += 1
+        self._notify(evicted)
+        self._disk_set(key, value, meta)
+
+    def entries(self):
+        # (ключ, meta) непросроченных записей дискового уровня, у которых есть meta
+        if not self.directory:
+            return
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if self._expired(os.path.getmtime(path), now):
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if _is_wrapped(stored) and stored['meta'] is not None:
+                yield name[:-len('.json')], stored['meta']
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def _memory_put(self, key, value, now):
+        # Возвращает ключи, покинувшие кэш совсем (с дисковым уровнем - никакие)
+        self._memory[key] = (now, value)
+        self._memory.move_to_end(key)
+        evicted = []
+        while len(self._memory) > self.memory_size:
+            evicted_key, _ = self._memory.popitem(last=False)
+            self._counters['evictions'] += 1
+            if not self.directory:
+                evicted.append(evicted_key)
+        return evicted
+
+    def _notify(self, keys):
+        if self.on_evict is not None:
+            for key in keys:
+                self.on_evict(key)
+
+    # Дисковый уровень: один JSON-файл на ключ, время записи берём из mtime
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _disk_get(self, key, now):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            if self._expired(os.path.getmtime(path), now):
+                self._remove(key)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return stored['value'] if _is_wrapped(stored) else stored
+
+    def _disk_set(self, key, value, meta=None):
+        if not self.directory:
+            return
+        path = self._path(key)
+        data = json.dumps({'value': value, 'meta': meta}, ensure_ascii=False).encode('utf-8')
+        # Пишем во временный файл и переименовываем, чтобы читатели не видели обрезанный JSON
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        now = time.time()
+        with self._lock:
+            self._disk_forget(key)
+            self._disk[key] = (now, len(data))
+            self._disk_bytes += len(data)
+            rescan = now - self._disk_scanned > DISK_RESCAN_INTERVAL
+        if rescan:
+            self._disk_scan()
+        self._disk_evict(now)
+
+    def _disk_scan(self):
+        # Полный обход каталога: при запуске и изредка, а не на каждую запись
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-len('.json')], st.st_size))
+        entries.sort()
+        with self._lock:
+            self._disk = OrderedDict((key, (mtime, size)) for mtime, key, size in entries)
+            self._disk_bytes = sum(size for _, _, size in entries)
+            self._disk_scanned = time.time()
+
+    def _disk_evict(self, now):
+        # Снимаем с начала индекса просроченные записи и самые старые сверх лимита
+        victims = []
+        with self._lock:
+            while self._disk:
+                key, (stored_at, size) = next(iter(self._disk.items()))
+                over = self.disk_max_bytes is not None and self._disk_bytes > self.disk_max_bytes
+                if not over and not self._expired(stored_at, now):
+                    break
+                self._disk_forget(key)
+                victims.append(key)
+        for key in victims:
+            self._remove(key)
+
+    def _disk_forget(self, key):
+        # Вызывается под self._lock
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            self._disk_bytes -= entry[1]
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            return
+        with self._lock:
+            self._disk_forget(key)
+            self._counters['evictions'] += 1
+        self._notify([key])
+
+
+def _is_wrapped(stored):
+    # Файл с метаданными: {"value": результат, "meta": ...}; старые файлы хранят
+    # результат как есть, а в результате анализа таких двух полей нет
+    return isinstance(stored, dict) and stored.keys() == {'value', 'meta'}
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError('Не дождались результата одинакового анализа')
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Объединяет одинаковые одновременные вычисления: первый запрос по ключу
+    выполняет работу, остальные ждут его результат."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = {'leaders': 0, 'coalesced': 0}
+
+    def begin(self, key):
+        # Возвращает (вызов, ведущий ли это запрос); ведущий обязан вызвать finish()
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._counters['coalesced'] += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self._counters['leaders'] += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.result = result
+        call.error = error
+        call.done.set()
+
+    def do(self, key, fn, timeout=None):
+        # timeout ограничивает только ожидание чужого результата
+        call, leader = self.begin(key)
+        if not leader:
+            return call.wait(timeout)
+        try:
+            result = fn()
+        except Exception as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result=result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._calls)
+        return stats
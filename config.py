@@ -0,0 +1,110 @@
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def _env_str(name, default):
+    return os.environ.get(name) or default
+
+
+# Кэш результатов анализа
+CACHE_MEMORY_SIZE = _env_int('NEURO_CACHE_MEMORY_SIZE', 256)
+# Каталог дискового кэша; пустое значение отключает дисковый уровень
+CACHE_DIR = _env_str('NEURO_CACHE_DIR', '')
+CACHE_TTL = _env_float('NEURO_CACHE_TTL', 7 * 24 * 3600)
+CACHE_DISK_MAX_BYTES = _env_int('NEURO_CACHE_DISK_MAX_BYTES', 256 * 1024 * 1024)
+
+# Фоновые задания анализа
+JOB_WORKERS = _env_int('NEURO_JOB_WORKERS', 4)
+JOB_QUEUE_SIZE = _env_int('NEURO_JOB_QUEUE_SIZE', 64)
+JOB_TTL = _env_float('NEURO_JOB_TTL', 3600)
+
+# Пул клиентов g4f
+CLIENT_POOL_SIZE = _env_int('NEURO_CLIENT_POOL_SIZE', 8)
+CLIENT_POOL_WARMUP = _env_int('NEURO_CLIENT_POOL_WARMUP', 1)
+
+# Прогрев после запуска: сколько секунд запрос анализа ждёт готовности процесса
+# до ответа 503 и через сколько секунд повторять упавший шаг прогрева
+WARMUP_WAIT = _env_float('NEURO_WARMUP_WAIT', 30)
+WARMUP_RETRY = _env_float('NEURO_WARMUP_RETRY', 5)
+
+# Провайдеры g4f в порядке предпочтения: имена классов из g4f.Provider или 'модуль:Класс'
+PROVIDERS = [name.strip() for name in _env_str('NEURO_PROVIDERS', 'Blackbox').split(',') if name.strip()]
+# Через сколько секунд без ответа дублировать запрос второму провайдеру; 0 отключает
+HEDGE_AFTER = _env_float('NEURO_HEDGE_AFTER', 0)
+# Сглаживание EWMA задержки и доли успешных ответов
+ROUTER_EWMA_ALPHA = _env_float('NEURO_ROUTER_EWMA_ALPHA', 0.2)
+# Провайдер с долей успехов ниже порога считается нездоровым на время паузы
+ROUTER_MIN_SUCCESS_RATE = _env_float('NEURO_ROUTER_MIN_SUCCESS_RATE', 0.5)
+ROUTER_COOLDOWN = _env_float('NEURO_ROUTER_COOLDOWN', 30)
+# Потоки для запросов к провайдерам: с запасом на дублирующие запросы и вызовы,
+# брошенные по сроку и дорабатывающие до своего timeout
+UPSTREAM_WORKERS = _env_int('NEURO_UPSTREAM_WORKERS', 128)
+# Срок анализа в секундах; клиент может сократить или продлить его заголовком
+# X-Request-Timeout, но не дольше REQUEST_TIMEOUT_MAX
+REQUEST_TIMEOUT = _env_float('NEURO_REQUEST_TIMEOUT', 60)
+REQUEST_TIMEOUT_MAX = _env_float('NEURO_REQUEST_TIMEOUT_MAX', 300)
+
+# Предобработка изображения перед отправкой провайдеру
+IMAGE_MAX_SIDE = _env_int('NEURO_IMAGE_MAX_SIDE', 1024)
+# Поля вокруг найденного рисунка, доля от его большей стороны
+IMAGE_CROP_MARGIN = _env_float('NEURO_IMAGE_CROP_MARGIN', 0.05)
+# Максимальный размер палитры для рисунков; 0 отключает квантование
+IMAGE_PALETTE_COLORS = _env_int('NEURO_IMAGE_PALETTE_COLORS', 16)
+# Пробовать ли WebP наряду с PNG
+IMAGE_WEBP = _env_int('NEURO_IMAGE_WEBP', 1)
+
+# Быстрый локальный анализ: сторона, до которой уменьшается лист
+FAST_MAX_SIDE = _env_int('NEURO_FAST_MAX_SIDE', 512)
+
+# Анализ по разделам (mode=sections): потоки для параллельных запросов разделов
+SECTION_WORKERS = _env_int('NEURO_SECTION_WORKERS', 64)
+
+# Рисунок журналом штрихов: ширина растра по умолчанию и наибольшая, которую
+# может запросить клиент, и предел числа точек в одном рисунке
+STROKES_RASTER_WIDTH = _env_int('NEURO_STROKES_RASTER_WIDTH', 1000)
+STROKES_RASTER_MAX = _env_int('NEURO_STROKES_RASTER_MAX', 2048)
+STROKES_MAX_POINTS = _env_int('NEURO_STROKES_MAX_POINTS', 100_000)
+
+# Пакетный анализ
+BATCH_CONCURRENCY = _env_int('NEURO_BATCH_CONCURRENCY', 4)
+BATCH_MAX_ITEMS = _env_int('NEURO_BATCH_MAX_ITEMS', 100)
+
+# Сервер. Фоновые задания и кэш в памяти живут внутри процесса, поэтому по умолчанию
+# один процесс с большим числом потоков: запросы к провайдеру почти всё время ждут сеть
+BIND = _env_str('NEURO_BIND', '0.0.0.0:8000')
+WORKERS = _env_int('NEURO_WORKERS', 1)
+# gthread - потоки; gevent - кооперативные гринлеты для тысяч одновременных запросов
+WORKER_CLASS = _env_str('NEURO_WORKER_CLASS', 'gthread')
+THREADS = _env_int('NEURO_THREADS', 256)
+WORKER_CONNECTIONS = _env_int('NEURO_WORKER_CONNECTIONS', 1000)
+WORKER_TIMEOUT = _env_int('NEURO_WORKER_TIMEOUT', 120)
+# Отладчик и перезагрузка встроенного сервера разработки (python app.py)
+DEBUG = _env_int('NEURO_DEBUG', 1)
+
+# Допуск запросов: одновременно выполняемые анализы и короткая очередь ожидания
+MAX_IN_FLIGHT = _env_int('NEURO_MAX_IN_FLIGHT', 64)
+ADMISSION_QUEUE_SIZE = _env_int('NEURO_ADMISSION_QUEUE_SIZE', 32)
+# Сколько секунд запрос может ждать в очереди, прежде чем получить 429
+ADMISSION_QUEUE_TIMEOUT = _env_float('NEURO_ADMISSION_QUEUE_TIMEOUT', 2.0)
+
+# Поиск почти одинаковых рисунков: порог расстояния Хэмминга (из 256 бит)
+# и допуск совпадения рамки рисунка в долях листа
+PHASH_MAX_DISTANCE = _env_int('NEURO_PHASH_MAX_DISTANCE', 24)
+PHASH_BBOX_TOLERANCE = _env_float('NEURO_PHASH_BBOX_TOLERANCE', 0.05)
+
+# История анализов в SQLite
+STORE_PATH = _env_str('NEURO_STORE_PATH', 'analyses.db')
+# Очередь фоновой записи; при переполнении анализ не попадает в историю, но ответ не ждёт
+STORE_QUEUE_SIZE = _env_int('NEURO_STORE_QUEUE_SIZE', 1024)
+STORE_THUMBNAIL_SIDE = _env_int('NEURO_STORE_THUMBNAIL_SIDE', 128)
+HISTORY_PAGE_SIZE = _env_int('NEURO_HISTORY_PAGE_SIZE', 20)
+HISTORY_PAGE_MAX = _env_int('NEURO_HISTORY_PAGE_MAX', 100)
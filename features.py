@@ -0,0 +1,100 @@
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Веса яркости ITU-R 601, как в PIL при переводе в 'L'
+LUMA_WEIGHTS = (299, 587, 114)
+# Смещение центра масс меньше этого считается расположением по центру
+CENTER_TOLERANCE = 0.05
+
+
+def ink_mask(pixels, threshold=24):
+    # Пиксели, по яркости заметно отличающиеся от белого фона
+    darkness = (255 - pixels.astype(np.int32)) @ LUMA_WEIGHTS // 1000
+    return darkness > threshold
+
+
+def extract_features(image, threshold=24, edge_band=0.01):
+    """Геометрические признаки рисунка на листе (RGB, белый фон).
+
+    Все координаты - доли ширины и высоты листа, отсчёт от левого верхнего угла.
+    """
+    ink = ink_mask(np.asarray(image), threshold)
+    height, width = ink.shape
+    total = int(ink.sum())
+    features = {
+        'sheet': [width, height],
+        'empty': total == 0,
+        'bbox': None,
+        'bbox_px': None,
+        'centroid': None,
+        'size_ratio': 0.0,
+        'fill_ratio': 0.0,
+        'stroke_density': 0.0,
+        'horizontal_bias': 0.0,
+        'vertical_bias': 0.0,
+        'edge_contact': {'left': False, 'right': False, 'top': False, 'bottom': False},
+    }
+    if total == 0:
+        return features
+
+    column_counts = ink.sum(axis=0)
+    row_counts = ink.sum(axis=1)
+    columns = np.flatnonzero(column_counts)
+    rows = np.flatnonzero(row_counts)
+    left, right = int(columns[0]), int(columns[-1]) + 1
+    top, bottom = int(rows[0]), int(rows[-1]) + 1
+
+    # Центр масс штрихов
+    centroid_x = float(column_counts @ np.arange(width)) / total / width
+    centroid_y = float(row_counts @ np.arange(height)) / total / height
+    bbox_area = (right - left) * (bottom - top)
+    band = max(1, round(edge_band * min(width, height)))
+
+    features.update({
+        'bbox': [round(left / width, 3), round(top / height, 3), round(right / width, 3), round(bottom / height, 3)],
+        'bbox_px': [left, top, right, bottom],
+        'centroid': [round(centroid_x, 3), round(centroid_y, 3)],
+        'size_ratio': round(bbox_area / (width * height), 4),
+        'fill_ratio': round(total / (width * height), 4),
+        'stroke_density': round(total / bbox_area, 4),
+        'horizontal_bias': round(centroid_x * 2 - 1, 3),
+        'vertical_bias': round(centroid_y * 2 - 1, 3),
+        'edge_contact': {
+            'left': left < band,
+            'right': right > width - band,
+            'top': top < band,
+            'bottom': bottom > height - band,
+        },
+    })
+    return features
+
+
+def describe_features(features):
+    # Текст для промпта: измеренные параметры, которые модель иначе оценивает на глаз
+    if features['empty']:
+        return ''
+    left, top, right, bottom = (round(value * 100) for value in features['bbox'])
+    centroid_x, centroid_y = (round(value * 100) for value in features['centroid'])
+    bias = features['horizontal_bias']
+    side = 'вправо' if bias > CENTER_TOLERANCE else 'влево' if bias < -CENTER_TOLERANCE else 'по центру'
+    edges = [label for key, label in (('left', 'левый'), ('right', 'правый'), ('top', 'верхний'), ('bottom', 'нижний'))
+             if features['edge_contact'][key]]
+    text = (
+        "Изображение обрезано по границам рисунка. Параметры, измеренные по пикселям исходного листа "
+        "(0% - левый/верхний край), используй их вместо оценки на глаз:\n"
+        f"    - Рисунок занимает по горизонтали {left}-{right}% ширины, по вертикали {top}-{bottom}% высоты листа\n"
+        f"    - Центр масс: {centroid_x}% ширины, {centroid_y}% высоты; смещение по горизонтали {bias:+.2f} ({side})\n"
+        f"    - Размер рамки рисунка: {features['size_ratio'] * 100:.1f}% площади листа\n"
+        f"    - Штрихи покрывают {features['fill_ratio'] * 100:.1f}% листа, плотность внутри рамки {features['stroke_density'] * 100:.1f}%\n"
+        f"    - Касается краёв листа (выходит за рамки): {', '.join(edges) if edges else 'нет'}"
+    )
+    strokes = features.get('strokes')
+    if strokes:
+        # Рисунок пришёл журналом штрихов: точные данные о том, как он нарисован
+        text += (
+            f"\n    - Нарисован {strokes['count']} штрихами общей длиной {strokes['length']:.1f} диагонали листа "
+            f"(в среднем {strokes['mean_length']:.2f}), средняя толщина {strokes['mean_width'] * 100:.1f}% "
+            f"ширины листа, цветов: {strokes['colors']}"
+        )
+    return text
@@ -0,0 +1,13 @@
+# Настройки gunicorn берутся из config.py (переменные окружения NEURO_*).
+# Модуль импортируется под другим именем: 'config' - зарезервированная настройка gunicorn
+import config as settings
+
+bind = settings.BIND
+workers = settings.WORKERS
+worker_class = settings.WORKER_CLASS
+threads = settings.THREADS
+worker_connections = settings.WORKER_CONNECTIONS
+timeout = settings.WORKER_TIMEOUT
+# Потоковые ответы (/analyze/stream, /analyze/batch) не должны обрываться по keep-alive
+keepalive = 5
+accesslog = '-'
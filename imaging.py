@@ -0,0 +1,141 @@
+import time
+from io import BytesIO
+
+from features import extract_features
+from lazy import lazy_import
+
+Image = lazy_import('PIL.Image')
+ImageChops = lazy_import('PIL.ImageChops')
+ImageOps = lazy_import('PIL.ImageOps')
+ImageStat = lazy_import('PIL.ImageStat')
+features = lazy_import('PIL.features')
+
+# Насколько пиксель должен отличаться от белого фона, чтобы считаться частью рисунка
+CONTENT_THRESHOLD = 24
+# Допустимая средняя ошибка квантования (0-255) по пикселям рисунка,
+# при которой разница на глаз не видна
+PALETTE_TOLERANCE = 16.0
+# Режимы, которые Image.reduce() уменьшает без преобразования
+REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+
+def normalize_mode(image):
+    # Прозрачный фон холста заливаем белым, всё приводим к RGB
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+        return Image.alpha_composite(background, image).convert('RGB')
+    if image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def content_mask(image):
+    # Маска пикселей, заметно отличающихся от белого фона
+    diff = ImageChops.difference(image, Image.new('RGB', image.size, (255, 255, 255)))
+    return diff.convert('L').point(lambda value: 255 if value > CONTENT_THRESHOLD else 0)
+
+
+def preprocess_image(image, max_side=1024, margin=0.05):
+    """Обрезает лист до рисунка и уменьшает его.
+
+    Возвращает обработанное изображение и геометрические признаки рисунка на исходном
+    листе (расположение, размер, касание краёв), которые после обрезки уже не восстановить.
+    """
+    # Для JPEG с камеры декодируем сразу в уменьшенном масштабе
+    if image.format == 'JPEG':
+        image.draft('RGB', (max_side, max_side))
+    image = normalize_mode(ImageOps.exif_transpose(image))
+    width, height = image.size
+
+    sheet_features = extract_features(image, threshold=CONTENT_THRESHOLD)
+    if sheet_features['bbox_px'] is not None:
+        left, top, right, bottom = sheet_features['bbox_px']
+        pad = int(max(right - left, bottom - top) * margin) + 2
+        image = image.crop((max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad)))
+
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+    return image, sheet_features
+
+
+def measure_sheet(image, max_side=512):
+    # Только признаки листа, без обрезки и кодирования: для быстрого локального анализа.
+    # Доли листа почти не зависят от разрешения, поэтому лист сначала уменьшаем
+    if image.format == 'JPEG':
+        image.draft('RGB', (max_side, max_side))
+    ImageOps.exif_transpose(image, in_place=True)
+    sheet = list(image.size)
+    # reduce() не работает с палитрой и 1-битными изображениями (PNG с холста,
+    # сканы): такие сначала приводим к RGB, остальные - уже после уменьшения
+    if image.mode not in REDUCIBLE_MODES:
+        image = normalize_mode(image)
+    factor = -(-max(image.size) // max_side)
+    if factor > 1:
+        image = image.reduce(factor)
+    sheet_features = extract_features(normalize_mode(image), threshold=CONTENT_THRESHOLD)
+    sheet_features['sheet'] = sheet
+    return sheet_features
+
+
+def find_palette(image, max_colors=16):
+    # Подбираем наименьшую палитру, которая передаёт рисунок без заметной ошибки.
+    # Палитру строим по уменьшенной копии: на полном изображении это в разы дольше.
+    # Для фотографий такой палитры нет, и они остаются полноцветными
+    sample = image
+    if max(image.size) > 256:
+        step = max(image.size) // 256 + 1
+        sample = image.resize((max(1, image.width // step), max(1, image.height // step)), Image.NEAREST)
+    # Ошибку считаем только по нарисованному: белый фон любая палитра передаёт точно
+    mask = content_mask(sample)
+    colors = 2
+    while colors <= max_colors:
+        palette = sample.quantize(colors, dither=Image.Dither.NONE)
+        if mask.getbbox() is None:
+            return colors, palette
+        error = sum(ImageStat.Stat(ImageChops.difference(sample, palette.convert('RGB')), mask).mean) / 3
+        if error <= PALETTE_TOLERANCE:
+            return colors, palette
+        colors *= 2
+    return None, None
+
+
+def encode_compact(image, max_colors=16, webp=True):
+    """Кодирует изображение в самый компактный из подходящих форматов.
+
+    Штриховые рисунки квантуются в палитру (2 цвета дают 1-битный PNG), затем
+    выбирается меньший из индексированного PNG и lossless WebP. Фотографии
+    кодируются в WebP с высоким качеством. Возвращает байты,
+    имя файла и отчёт о времени кодирования и размере.
+    """
+    start = time.perf_counter()
+    candidates = []
+    colors, palette = find_palette(image, max_colors) if max_colors else (None, None)
+    webp = webp and features.check('webp')
+
+    if colors is not None:
+        indexed = image.quantize(palette=palette, dither=Image.Dither.NONE)
+        candidates.append(('png', _save(indexed, 'PNG')))
+        if webp:
+            # method=1 почти не уступает в размере более медленным режимам
+            candidates.append(('webp', _save(indexed.convert('RGB'), 'WEBP', lossless=True, method=1)))
+    elif webp:
+        # Для фотографий lossless слишком велик и медленен; качество 90 на глаз неотличимо
+        candidates.append(('webp', _save(image, 'WEBP', quality=90, method=4)))
+    else:
+        candidates.append(('png', _save(image, 'PNG')))
+
+    extension, data = min(candidates, key=lambda candidate: len(candidate[1]))
+    report = {
+        'format': extension,
+        'colors': colors,
+        'bytes': len(data),
+        'encode_ms': round((time.perf_counter() - start) * 1000, 1),
+    }
+    return data, f'animal.{extension}', report
+
+
+def _save(image, image_format, **params):
+    buffer = BytesIO()
+    image.save(buffer, image_format, **params)
+    return buffer.getvalue()
@@ -0,0 +1,68 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobManager:
+    """Ограниченный пул фоновых исполнителей с хранением статуса заданий."""
+
+    def __init__(self, workers=4, queue_size=64, ttl=3600):
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            self._purge(time.time())
+            if self._pending >= self.queue_size:
+                raise QueueFull('Очередь заданий переполнена, попробуйте позже')
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id,
+                'status': 'queued',
+                'created_at': time.time(),
+                'finished_at': None,
+            }
+            self._pending += 1
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status='running')
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._finish(job_id, status='failed', error=str(e))
+        else:
+            self._finish(job_id, status='done', result=result)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _finish(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields, finished_at=time.time())
+            self._pending -= 1
+
+    def _purge(self, now):
+        # Завершённые задания хранятся ttl секунд, затем забываются
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['finished_at'] is not None and now - job['finished_at'] > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,28 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Модуль, который загрузится при первом обращении к его атрибутам.
+
+    Тяжёлые зависимости (g4f, PIL, numpy) не нужны для запуска процесса и отдачи
+    страницы: их загружает фоновый прогрев (warmup.Preflight), а запросы анализа
+    ждут его окончания. LazyLoader в Python 3.11 не защищён от одновременной первой
+    загрузки из разных потоков, поэтому до готовности их трогает только прогрев.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f'Модуль {name} не найден', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    # Как при обычном импорте: подмодуль доступен атрибутом пакета
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
@@ -0,0 +1,156 @@
+import threading
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+Image = lazy_import('PIL.Image')
+
+
+def dhash(image, hash_size=16):
+    # Разностный хэш: знак перепада яркости между соседними ячейками уменьшенной копии
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.BOX, reducing_gap=2.0)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] < pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def index_entry(name, description, variant, image_hash, bbox):
+    # Метаданные записи индекса, которые кэш хранит на диске вместе с результатом
+    return {'name': name, 'description': description, 'variant': variant, 'phash': image_hash, 'bbox': bbox}
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """BK-дерево по расстоянию Хэмминга: поиск в радиусе без перебора всех хэшей.
+
+    Удалённые узлы остаются в дереве пустыми (данные None), пока дерево не
+    перестроят: удаление из середины BK-дерева потребовало бы перестроить поддерево.
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+        self.removed = 0
+
+    def add(self, value, item):
+        # Узел - [хэш, данные, {расстояние: потомок}]; возвращается для remove()
+        node = [value, item, {}]
+        self.size += 1
+        if self._root is None:
+            self._root = node
+            return node
+        current = self._root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return node
+            current = child
+
+    def remove(self, node):
+        if node[1] is not None:
+            node[1] = None
+            self.size -= 1
+            self.removed += 1
+
+    def search(self, value, radius):
+        # Все (расстояние, данные) не дальше radius; по неравенству треугольника
+        # спускаемся только в поддеревья с расстоянием в [d - radius, d + radius]
+        results = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius and node[1] is not None:
+                results.append((distance, node[1]))
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return results
+
+
+class NearDuplicateIndex:
+    """Индекс прошлых рисунков для поиска почти одинаковых с тем же названием и описанием.
+
+    Рисунки сравниваются только внутри одного варианта анализа (variant - как в
+    ключе кэша: ответ режима sections не подходит полному анализу и наоборот).
+
+    Хэш считается по обрезанному рисунку, поэтому расположение на листе сравнивается
+    отдельно: рамки рисунков должны совпадать с точностью bbox_tolerance.
+
+    Индекс ссылается на ключи кэша результатов и живёт вместе с ним: вытесненные
+    из кэша ключи удаляются через discard(), а после перезапуска индекс
+    восстанавливается из дискового уровня кэша (rebuild()).
+    """
+
+    def __init__(self, max_distance=24, bbox_tolerance=0.05):
+        self.max_distance = max_distance
+        self.bbox_tolerance = bbox_tolerance
+        self._trees = {}
+        self._nodes = {}
+        self._lock = threading.Lock()
+        self._counters = {'lookups': 0, 'hits': 0}
+
+    def add(self, name, description, variant, image_hash, bbox, key):
+        with self._lock:
+            # Повторный анализ того же рисунка (force) не добавляет второй узел
+            if key in self._nodes:
+                return
+            group = (name, description, variant)
+            tree = self._trees.setdefault(group, BKTree())
+            self._nodes[key] = (group, tree.add(image_hash, (bbox, key)))
+
+    def discard(self, key):
+        with self._lock:
+            stored = self._nodes.pop(key, None)
+            if stored is None:
+                return
+            group, node = stored
+            tree = self._trees[group]
+            tree.remove(node)
+            if tree.size == 0:
+                del self._trees[group]
+            elif tree.removed > tree.size:
+                self._rebuild_tree(group)
+
+    def rebuild(self, entries):
+        # entries: (ключ, метаданные из index_entry()) записей дискового уровня кэша
+        for key, meta in entries:
+            self.add(meta['name'], meta['description'], meta['variant'], meta['phash'], meta['bbox'], key)
+
+    def find(self, name, description, variant, image_hash, bbox):
+        # Подходящие рисунки как список (расстояние, ключ), ближайшие первыми
+        with self._lock:
+            self._counters['lookups'] += 1
+            tree = self._trees.get((name, description, variant))
+            matches = tree.search(image_hash, self.max_distance) if tree is not None else []
+            found = sorted(
+                (distance, key) for distance, (stored_bbox, key) in matches
+                if self._same_placement(bbox, stored_bbox)
+            )
+            if found:
+                self._counters['hits'] += 1
+        return found
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._nodes)
+        return stats
+
+    def _rebuild_tree(self, group):
+        # Пустых узлов стало больше живых: переносим живые в новое дерево
+        tree = BKTree()
+        for key, (entry_group, node) in self._nodes.items():
+            if node[1] is not None and entry_group == group:
+                self._nodes[key] = (group, tree.add(node[0], node[1]))
+        self._trees[group] = tree
+
+    def _same_placement(self, bbox, stored_bbox):
+        if bbox is None or stored_bbox is None:
+            return bbox == stored_bbox
+        return all(abs(a - b) <= self.bbox_tolerance for a, b in zip(bbox, stored_bbox))
@@ -0,0 +1,332 @@
+import importlib
+import logging
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from lazy import lazy_import
+
+# g4f со всеми провайдерами грузится долго: до первого клиента его не импортируем
+g4f = lazy_import('g4f')
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self):
+        super().__init__('Время ожидания ответа провайдера истекло')
+
+
+def remaining(deadline):
+    # Секунды до срока по time.monotonic(); None - срока нет
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceeded()
+    return left
+
+
+def resolve_provider(name):
+    # Имя класса из g4f.Provider или путь вида 'модуль:Класс' для собственных провайдеров
+    if ':' in name:
+        module_name, class_name = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), class_name)
+    provider = getattr(g4f.Provider, name, None)
+    if provider is None:
+        raise ValueError(f'Неизвестный провайдер g4f: {name}')
+    return provider
+
+
+class ClientPool:
+    """Общий для процесса пул готовых клиентов g4f одного провайдера.
+
+    provider - класс провайдера или имя для resolve_provider; имя разрешается
+    при первом клиенте (или в resolve()), а не при создании пула.
+    """
+
+    def __init__(self, provider, size=8):
+        self.provider = provider
+        self.size = size
+        self._clients = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def resolve(self):
+        with self._lock:
+            if isinstance(self.provider, str):
+                self.provider = resolve_provider(self.provider)
+            return self.provider
+
+    def warm_up(self):
+        # Создаём клиентов заранее, чтобы первый запрос не платил за настройку провайдера
+        while self._clients.qsize() < self.size:
+            try:
+                self._clients.put_nowait(self._new_client())
+            except queue.Full:
+                break
+
+    @contextmanager
+    def client(self):
+        try:
+            client = self._clients.get_nowait()
+        except queue.Empty:
+            # Пул исчерпан: не блокируем запрос, а создаём ещё одного клиента
+            client = self._new_client()
+        try:
+            yield client
+        finally:
+            try:
+                self._clients.put_nowait(client)
+            except queue.Full:
+                pass
+
+    def stats(self):
+        with self._lock:
+            created = self._created
+        return {'size': self.size, 'idle': self._clients.qsize(), 'created': created}
+
+    def _new_client(self):
+        provider = self.resolve()
+        with self._lock:
+            self._created += 1
+        return g4f.Client(provider=provider)
+
+
+class ProviderStats:
+    """Скользящая статистика провайдера: EWMA и p95 задержки, доля успешных ответов."""
+
+    def __init__(self, alpha=0.2, window=200):
+        self.alpha = alpha
+        self.latency_ewma = None
+        self.success_rate = 1.0
+        self.requests = 0
+        self.failures = 0
+        self.last_failure = None
+        self._samples = deque(maxlen=window)
+
+    def record(self, latency, ok):
+        self.requests += 1
+        self.success_rate += self.alpha * ((1.0 if ok else 0.0) - self.success_rate)
+        if not ok:
+            self.failures += 1
+            self.last_failure = time.time()
+            return
+        # Задержку учитываем только по успешным ответам: быстрые ошибки не делают провайдера «быстрым»
+        self._samples.append(latency)
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += self.alpha * (latency - self.latency_ewma)
+
+    def mark_down(self):
+        # Провайдер не удалось подготовить: нездоров до конца cooldown, затем снова пробуется
+        self.failures += 1
+        self.last_failure = time.time()
+        self.success_rate = 0.0
+
+    def sort_key(self):
+        # Ещё не опрошенные провайдеры идут первыми, чтобы получить оценку задержки;
+        # провайдеры без единого успешного ответа — последними
+        if self.latency_ewma is not None:
+            return self.latency_ewma
+        return 0.0 if self.requests == 0 else math.inf
+
+    def p95(self):
+        if not self._samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[max(0, math.ceil(0.95 * len(samples)) - 1)]
+
+    def snapshot(self):
+        return {
+            'latency_ewma': self.latency_ewma,
+            'latency_p95': self.p95(),
+            'success_rate': self.success_rate,
+            'requests': self.requests,
+            'failures': self.failures,
+        }
+
+
+class ProviderRouter:
+    """Отправляет запрос самому быстрому здоровому провайдеру, при необходимости дублирует его."""
+
+    def __init__(self, pools, hedge_after=0, alpha=0.2, min_success_rate=0.5,
+                 cooldown=30, workers=64):
+        if not pools:
+            raise ValueError('Не задан ни один провайдер (NEURO_PROVIDERS)')
+        self.pools = pools
+        self.hedge_after = hedge_after
+        self.min_success_rate = min_success_rate
+        self.cooldown = cooldown
+        self._stats = {name: ProviderStats(alpha) for name in pools}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upstream')
+
+    def warm_up(self, clients=True):
+        # Импорт провайдеров и, если нужно, заполнение пулов клиентов. Ошибка одного
+        # провайдера не останавливает прогрев: он помечается нездоровым, а запросы
+        # при недоступности всех провайдеров получают быстрый локальный анализ
+        for name, pool in self.pools.items():
+            try:
+                pool.resolve()
+                if clients:
+                    pool.warm_up()
+            except Exception as e:
+                logger.error('Провайдер %s не подготовлен: %s', name, e)
+                with self._lock:
+                    self._stats[name].mark_down()
+
+    def ranked(self):
+        now = time.time()
+        healthy, unhealthy = [], []
+        with self._lock:
+            for name, stats in self._stats.items():
+                cooling = stats.last_failure is not None and now - stats.last_failure < self.cooldown
+                if stats.success_rate < self.min_success_rate and cooling:
+                    unhealthy.append(name)
+                else:
+                    healthy.append(name)
+            healthy.sort(key=lambda name: self._stats[name].sort_key())
+        # Нездоровые остаются в конце списка как последний резерв
+        return healthy + unhealthy
+
+    def complete(self, messages, deadline=None, **kwargs):
+        # Возвращает (ответ, имя провайдера). Со сроком (deadline по time.monotonic())
+        # вызовы идут в пуле потоков: по истечении срока запрос освобождается сразу,
+        # а провайдер получает оставшееся время как timeout, чтобы брошенный вызов
+        # тоже завершился и не занимал поток
+        candidates = self.ranked()
+        if deadline is None and (not self.hedge_after or len(candidates) < 2):
+            last_error = None
+            for name in candidates:
+                try:
+                    return self._call(name, messages, kwargs), name
+                except Exception as e:
+                    last_error = e
+            raise last_error
+
+        pending = {}
+
+        def launch():
+            name = candidates.pop(0)
+            call_kwargs = kwargs if deadline is None else dict(kwargs, timeout=remaining(deadline))
+            pending[self._executor.submit(self._call, name, messages, call_kwargs)] = name
+
+        launch()
+        hedged = False
+        last_error = None
+        try:
+            while pending:
+                hedge = self.hedge_after if self.hedge_after and candidates and not hedged else None
+                left = remaining(deadline)
+                timeout = min(t for t in (hedge, left) if t is not None) if hedge or left else None
+                done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    if hedge is None or (left is not None and left <= hedge):
+                        raise DeadlineExceeded()
+                    # Первый провайдер не уложился в порог: дублируем запрос следующему
+                    hedged = True
+                    launch()
+                    continue
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        return future.result(), name
+                    except Exception as e:
+                        last_error = e
+                        if candidates:
+                            launch()
+            raise last_error
+        finally:
+            # Ещё не начатые вызовы больше не нужны; начатые доработают в фоне
+            for future in pending:
+                future.cancel()
+
+    def stream(self, messages, deadline=None, **kwargs):
+        # Отдаёт пары (имя провайдера, фрагмент); переключается на следующего провайдера,
+        # только если ошибка случилась до первого фрагмента. Поток провайдера читается
+        # в пуле потоков: ожидание фрагмента ограничено сроком, а закрытие генератора
+        # (клиент отключился) останавливает чтение и закрывает ответ провайдера
+        last_error = None
+        for name in self.ranked():
+            call_kwargs = kwargs if deadline is None else dict(kwargs, timeout=remaining(deadline))
+            chunks = queue.Queue()
+            stop = threading.Event()
+            self._executor.submit(self._pump, name, messages, call_kwargs, chunks, stop)
+            started = False
+            try:
+                while True:
+                    try:
+                        kind, value = chunks.get(timeout=remaining(deadline))
+                    except queue.Empty:
+                        raise DeadlineExceeded()
+                    if kind == 'end':
+                        return
+                    if kind == 'error':
+                        if started:
+                            raise value
+                        last_error = value
+                        break
+                    started = True
+                    yield name, value
+            finally:
+                stop.set()
+        raise last_error
+
+    def stats(self):
+        with self._lock:
+            stats = {name: stats.snapshot() for name, stats in self._stats.items()}
+        for name, pool in self.pools.items():
+            stats[name]['pool'] = pool.stats()
+        return stats
+
+    def _call(self, name, messages, kwargs):
+        start = time.monotonic()
+        try:
+            with self.pools[name].client() as client:
+                response = client.chat.completions.create(messages, "", **kwargs)
+        except Exception:
+            self._record(name, time.monotonic() - start, False)
+            raise
+        self._record(name, time.monotonic() - start, True)
+        return response
+
+    def _pump(self, name, messages, kwargs, chunks, stop):
+        # Читает поток провайдера в очередь: ('chunk', фрагмент), затем ('end', None)
+        # или ('error', исключение); после stop дальше не читает.
+        # В статистику идёт время до первого фрагмента, а не всей генерации: так
+        # задержка сравнима с complete() и не искажает выбор провайдера и порог дублирования
+        start = time.monotonic()
+        recorded = False
+        try:
+            with self.pools[name].client() as client:
+                stream = client.chat.completions.create(messages, "", stream=True, **kwargs)
+                try:
+                    for chunk in stream:
+                        if not recorded:
+                            self._record(name, time.monotonic() - start, True)
+                            recorded = True
+                        if stop.is_set():
+                            return
+                        chunks.put(('chunk', chunk))
+                finally:
+                    close = getattr(stream, 'close', None)
+                    if close is not None:
+                        close()
+        except Exception as e:
+            if not recorded:
+                self._record(name, time.monotonic() - start, False)
+            chunks.put(('error', e))
+            return
+        if not recorded:
+            self._record(name, time.monotonic() - start, True)
+        chunks.put(('end', None))
+
+    def _record(self, name, latency, ok):
+        with self._lock:
+            self._stats[name].record(latency, ok)
@@ -0,0 +1,99 @@
+import re
+
+# Таблицы интерпретации те же, что в критериях промпта (sections.SECTIONS): правило
+# срабатывает по измеренным признакам рисунка или по ключевым словам названия и описания.
+# Для признаков, которым промпт не даёт значения (вертикальное положение,
+# плотность штрихов, звучание названия), правил нет.
+
+# Пороговые таблицы: (порог сверху, находка, значение), (порог снизу, находка, значение)
+
+# Смещение центра масс по горизонтали (-1 левый край, +1 правый)
+HORIZONTAL_RULES = [
+    (0.15, 'Рисунок смещён вправо', 'взгляд в будущее, надежда на лучшее'),
+    (-0.15, 'Рисунок смещён влево', 'зацикленность на прошлом, неуверенность'),
+]
+
+# Доля листа, занятая рамкой рисунка
+SIZE_RULES = [
+    (0.45, 'Крупный рисунок', 'уверенность или эгоцентричность'),
+    (0.08, 'Мелкий рисунок', 'неуверенность, мелочность'),
+]
+
+# Ключевые слова названия и описания (начала слов, регистр не важен)
+KEYWORD_RULES = [
+    ('Особенности', r'\b(зуб|клык|когт|пасть)', 'Агрессивные элементы (зубы, когти)',
+     'желание напасть или защититься'),
+    ('Особенности', r'\b(панцир|шип|игл|чешу|брон)', 'Защитные элементы (панцирь, шипы)',
+     'потребность в защите'),
+    ('Особенности', r'\b(крыл|лета|порха)', 'Крылья', 'желание свободы и независимости'),
+    ('Особенности', r'\bрог', 'Рога', 'оборона'),
+    ('Особенности', r'\b(без рта|нет рта|безрот)', 'Нет рта', 'полное нежелание общаться'),
+    ('Особенности', r'\b(молч|закрыт\w* рот|рот закрыт)', 'Закрытый рот',
+     'антисоциальность, замкнутость'),
+    ('Особенности', r'\b(болтл|разговорч|поёт|поет|кричит|открыт\w* рот|рот открыт)', 'Открытый рот',
+     'болтливость'),
+    ('Детализация', r'\b(украш|корон|бант|ожерел|серьг|браслет)', 'Украшения',
+     'желание выделиться'),
+    ('Детализация', r'\b(меч(?!т)|книг|шляп|сумк|инструмент|посох|предмет)', 'Предметы',
+     'указания на увлечения, творческие способности'),
+]
+
+
+def _threshold_rule(value, rules):
+    # Первое правило таблицы срабатывает при value >= порога, второе - при value <= порога
+    (high, high_finding, high_meaning), (low, low_finding, low_meaning) = rules
+    if value >= high:
+        return high_finding, high_meaning
+    if value <= low:
+        return low_finding, low_meaning
+    return None
+
+
+def interpret(features, name, description):
+    """Локальная интерпретация рисунка без обращения к модели.
+
+    Возвращает список сработавших правил и их изложение в markdown.
+    """
+    findings = []
+
+    def add(aspect, finding, meaning):
+        findings.append({'aspect': aspect, 'finding': finding, 'meaning': meaning})
+
+    if not features['empty']:
+        bias = features['horizontal_bias']
+        horizontal = _threshold_rule(bias, HORIZONTAL_RULES)
+        if horizontal:
+            add('Расположение на листе', f'{horizontal[0]} ({bias:+.2f})', horizontal[1])
+
+        size = _threshold_rule(features['size_ratio'], SIZE_RULES)
+        if size:
+            add('Размер', f"{size[0]} ({features['size_ratio'] * 100:.0f}% листа)", size[1])
+        if any(features['edge_contact'].values()):
+            add('Размер', 'Рисунок выходит за рамки листа',
+                'когнитивный диссонанс, неуравновешенность, отсутствие самоконтроля')
+
+    text = f'{name} {description}'.lower()
+    for aspect, pattern, finding, meaning in KEYWORD_RULES:
+        if re.search(pattern, text):
+            add(aspect, finding, meaning)
+
+    return {'interpretation': findings, 'analysis': render_markdown(findings)}
+
+
+def render_markdown(findings):
+    # Находки группируются по аспектам в порядке первого появления
+    groups = {}
+    for item in findings:
+        groups.setdefault(item['aspect'], []).append(item)
+    lines = ['## Быстрый анализ']
+    if not groups:
+        lines += ['', 'Ни одно правило из таблиц интерпретации не сработало.']
+    for aspect, items in groups.items():
+        lines += ['', f'### {aspect}']
+        lines += [f"- **{item['finding']}** - {item['meaning']}" for item in items]
+    lines += [
+        '',
+        '_Анализ построен локально по измеренным параметрам рисунка и ключевым словам описания, '
+        'без обращения к нейросети._',
+    ]
+    return '\n'.join(lines)
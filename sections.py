@@ -0,0 +1,101 @@
+from features import describe_features
+
+# Критерии анализа по разделам - единственное их описание: полный промпт
+# (build_prompt) перечисляет все разделы, а в режиме sections каждый
+# запрашивается у модели отдельно и текст собирается локально в исходном порядке.
+# (ключ, заголовок, что написать в разделе)
+SECTIONS = [
+    ('appearance', '1. Внешний вид', """
+    - На какие реальные или фантастические существа похоже животное
+    - Основные визуальные характеристики
+    - Уникальные особенности
+    """),
+    ('psychology', '2. Психологический анализ', """
+    а) Расположение на листе:
+    - Где расположен рисунок (центр, верх, низ, лево, право)
+    - Животное расположено ближе к левому или правому краю?
+    Если к правому - взгляд в будущее, надежда на лучшее (в зависимости от контекста), если к левому - зацикленность на прошлом, неуверенность.
+    - Интерпретация расположения
+
+    б) Размер и пропорции:
+    - Размер относительно листа
+    Крупное - уверенность или эгоцентричность, Мелкое - неуверенность, мелочность. Выходит за рамки - когнитивный диссонанс, неуравновешенность, отсутствие самоконтроля
+    - Пропорции тела
+    Голова больше туловища - Тревожность или сосредоточенность на себе. Туловище больше - желание быть сильным.
+    - Интерпретация размера
+
+    в) Детализация:
+    - Уровень проработки деталей
+    - Какие элементы особенно выделены
+    Украшения - желание выделиться, Предметы - указания на увлечение, творческие способности.
+    - Интерпретация детализации
+
+    г) Особенности:
+    - Наличие агрессивных элементов (острые зубы, когти)
+    Желание напасть или защититься
+    - Защитные элементы (панцирь, шипы)
+    Защитные элементы
+    - Компенсаторные элементы (крылья, рога)
+    Крылья - желание свободы и независимости, рога - оборона.
+    - Эмоциональные признаки (глаза, рот)
+    Закрытый рот - антисоциальность, замкнутость, открытый рот - болтливость, нет рта - полное нежелание общаться
+    """),
+    ('naming', '3. Анализ названия и описания', """
+    - Лингвистические особенности названия
+    - Ключевые слова в описании
+    - Соответствие между рисунком и описанием
+    """),
+    ('portrait', '4. Психологический портрет и выводы', """
+    - Самооценка и уровень притязаний
+    - Эмоциональное состояние
+    - Социальные установки
+    - Механизмы психологической защиты
+    - Когнитивные особенности
+
+    Выводы:
+    - Основные психологические характеристики
+    - Рекомендации (если уместно)
+    """),
+]
+
+
+def _introduction(name, description, features):
+    features_note = describe_features(features) if features else ''
+    return f"""
+    Ты - профессиональный психолог, анализирующий рисунки несуществующих животных.
+    Перед тобой рисунок животного "{name}" с описанием: "{description}".
+    {features_note}
+    """
+
+
+CONCLUSION = """
+    Анализ должен быть конкретным, опираться на визуальные признаки рисунка и данные описания.
+    Избегай общих фраз, делай акцент на уникальных особенностях данного рисунка.
+    """
+
+
+def build_prompt(name, description, features=None):
+    # Полный анализ одним запросом: все разделы по порядку
+    criteria = '\n    '.join(f'{title}:{instructions}' for _, title, instructions in SECTIONS)
+    return _introduction(name, description, features) + f"""
+    Проведи детальный анализ по следующим критериям:
+
+    {criteria}""" + CONCLUSION
+
+
+def build_section_prompt(section, name, description, features=None):
+    _, title, instructions = section
+    return _introduction(name, description, features) + f"""
+    Напиши только один раздел анализа - "{title}" - по следующим критериям:
+    {instructions}
+    Не повторяй заголовок раздела и не пиши другие разделы: их готовят отдельно.""" + CONCLUSION
+
+
+def merge_sections(sections):
+    # sections: номер раздела -> {'content': ...} или {'error': ...}; собираем по порядку
+    blocks = []
+    for index, (_, title, _) in enumerate(SECTIONS):
+        section = sections.get(index) or {'error': 'нет ответа'}
+        content = section.get('content') or f"_Раздел не получен: {section.get('error', 'пустой ответ')}_"
+        blocks.append(f'## {title}\n\n{content.strip()}')
+    return '\n\n'.join(blocks)
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    image_hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    analysis TEXT NOT NULL,
+    provider TEXT,
+    features TEXT,
+    timings TEXT,
+    thumbnail BLOB,
+    thumbnail_type TEXT
+);
+CREATE INDEX IF NOT EXISTS analyses_image_hash ON analyses (image_hash);
+CREATE INDEX IF NOT EXISTS analyses_created_at ON analyses (created_at);
+"""
+
+# Поля списка истории: без текста анализа и миниатюры
+SUMMARY_COLUMNS = 'id, created_at, image_hash, name, description, provider'
+DETAIL_COLUMNS = SUMMARY_COLUMNS + ', analysis, features, timings, thumbnail IS NOT NULL AS has_thumbnail'
+
+
+def new_id(now=None):
+    # Идентификатор упорядочен по времени: 13 hex-цифр микросекунд и 6 случайных,
+    # поэтому первичный ключ служит и курсором постраничной выдачи
+    micros = int((now if now is not None else time.time()) * 1_000_000)
+    return '%013x%s' % (micros, os.urandom(3).hex())
+
+
+class AnalysisStore:
+    """История анализов в SQLite.
+
+    Запись не блокирует ответ: save() сразу возвращает идентификатор, а строки
+    (вместе с миниатюрой) пишет фоновый поток пачками в одной транзакции. До
+    записи анализ доступен из памяти, так что его можно прочитать сразу после
+    ответа. Чтение идёт через соединения, открытые по одному на поток, в режиме
+    WAL не ждёт писателя.
+    """
+
+    def __init__(self, path, queue_size=1024, thumbnail_side=128, batch_size=64):
+        self.path = path
+        self.thumbnail_side = thumbnail_side
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {'saved': 0, 'dropped': 0, 'write_errors': 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+        connection.commit()
+        self._writer = threading.Thread(target=self._write_loop, name='store-writer', daemon=True)
+        self._writer.start()
+
+    def save(self, record, image=None):
+        # record: image_hash, name, description, analysis, provider, features, timings;
+        # image - обрезанный рисунок PIL, из него фоновый поток делает миниатюру
+        now = time.time()
+        analysis_id = new_id(now)
+        record = dict(record, id=analysis_id, created_at=now)
+        with self._lock:
+            self._pending[analysis_id] = record
+        try:
+            self._queue.put_nowait((record, image))
+        except queue.Full:
+            # Писатель не успевает: результат уже отдан клиенту, историю не задерживаем
+            with self._lock:
+                del self._pending[analysis_id]
+                self._counters['dropped'] += 1
+            logger.warning('Очередь записи истории переполнена, анализ %s не сохранён', analysis_id)
+            return None
+        return analysis_id
+
+    def get(self, analysis_id):
+        with self._lock:
+            pending = self._pending.get(analysis_id)
+        if pending is not None:
+            return _public(pending, has_thumbnail=False)
+        row = self._read(f'SELECT {DETAIL_COLUMNS} FROM analyses WHERE id = ?', (analysis_id,), one=True)
+        return _row_to_dict(row) if row is not None else None
+
+    def thumbnail(self, analysis_id):
+        # (байты, MIME-тип) или None
+        row = self._read('SELECT thumbnail, thumbnail_type FROM analyses WHERE id = ?', (analysis_id,), one=True)
+        if row is None or row['thumbnail'] is None:
+            return None
+        return bytes(row['thumbnail']), row['thumbnail_type']
+
+    def list(self, before=None, limit=20, image_hash=None):
+        # Новые первыми; продолжение - с before=<id последней записи страницы>
+        conditions, params = [], []
+        if before:
+            conditions.append('id < ?')
+            params.append(before)
+        if image_hash:
+            conditions.append('image_hash = ?')
+            params.append(image_hash)
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        rows = self._read(
+            f'SELECT {SUMMARY_COLUMNS} FROM analyses {where} ORDER BY id DESC LIMIT ?',
+            params + [limit],
+        )
+        return [dict(row) for row in rows]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['pending'] = len(self._pending)
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+    def flush(self, timeout=None):
+        # Дождаться записи всего, что уже поставлено в очередь
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _read(self, sql, params, one=False):
+        cursor = self._connect().execute(sql, params)
+        return cursor.fetchone() if one else cursor.fetchall()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [self._row(record, image) for record, image in batch]
+            failed = False
+            try:
+                connection = self._connect()
+                with connection:
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO analyses (id, created_at, image_hash, name, description, '
+                        'analysis, provider, features, timings, thumbnail, thumbnail_type) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        rows,
+                    )
+            except sqlite3.Error as e:
+                logger.error('Не удалось записать историю анализов: %s', e)
+                failed = True
+            with self._lock:
+                for record, _ in batch:
+                    self._pending.pop(record['id'], None)
+                self._counters['write_errors' if failed else 'saved'] += len(batch)
+
+    def _row(self, record, image):
+        thumbnail, thumbnail_type = self._make_thumbnail(image)
+        return (
+            record['id'], record['created_at'], record['image_hash'], record['name'],
+            record['description'], record['analysis'], record.get('provider'),
+            json.dumps(record.get('features'), ensure_ascii=False),
+            json.dumps(record.get('timings'), ensure_ascii=False),
+            thumbnail, thumbnail_type,
+        )
+
+    def _make_thumbnail(self, image):
+        if image is None:
+            return None, None
+        try:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((self.thumbnail_side, self.thumbnail_side))
+            buffer = BytesIO()
+            thumbnail.save(buffer, 'WEBP', quality=80)
+            return buffer.getvalue(), 'image/webp'
+        except Exception as e:
+            logger.warning('Не удалось сделать миниатюру: %s', e)
+            return None, None
+
+
+def _public(record, has_thumbnail):
+    result = {key: record.get(key) for key in (
+        'id', 'created_at', 'image_hash', 'name', 'description', 'provider', 'analysis', 'features', 'timings',
+    )}
+    result['has_thumbnail'] = has_thumbnail
+    return result
+
+
+def _row_to_dict(row):
+    record = dict(row)
+    for key in ('features', 'timings'):
+        record[key] = json.loads(record[key]) if record[key] else None
+    record['has_thumbnail'] = bool(record['has_thumbnail'])
+    return record
@@ -0,0 +1,105 @@
+import json
+import math
+import re
+
+from lazy import lazy_import
+
+Image = lazy_import('PIL.Image')
+ImageDraw = lazy_import('PIL.ImageDraw')
+
+COLOR_PATTERN = re.compile(r'^#[0-9a-fA-F]{6}$')
+
+
+class InvalidStrokes(ValueError):
+    pass
+
+
+def parse_strokes(raw, max_points=100_000):
+    """Журнал штрихов со страницы (строка JSON или уже разобранный словарь).
+
+    {"size": [1000, 800], "strokes": [{"color": "#006064", "width": 10, "points": [x0, y0, x1, y1, ...]}]}
+
+    Координаты и толщина - в логических единицах листа size, отсчёт от левого
+    верхнего угла; штрихи идут в порядке рисования.
+    """
+    try:
+        log = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+        width, height = (float(value) for value in log['size'])
+        strokes = log['strokes']
+    except (TypeError, ValueError, KeyError) as e:
+        raise InvalidStrokes(f'Некорректный журнал штрихов: {e}')
+    if not (0 < width <= 10_000 and 0 < height <= 10_000):
+        raise InvalidStrokes('Размер листа вне допустимых пределов')
+    if not isinstance(strokes, list):
+        raise InvalidStrokes('strokes должен быть списком')
+
+    parsed = []
+    total = 0
+    for stroke in strokes:
+        try:
+            color = stroke.get('color', '#000000')
+            line_width = float(stroke.get('width', 1))
+            points = [float(value) for value in stroke['points']]
+        except (AttributeError, TypeError, ValueError, KeyError) as e:
+            raise InvalidStrokes(f'Некорректный штрих: {e}')
+        if not COLOR_PATTERN.match(str(color)):
+            raise InvalidStrokes(f'Некорректный цвет штриха: {color}')
+        if not 0 < line_width <= width / 4:
+            raise InvalidStrokes(f'Некорректная толщина штриха: {line_width}')
+        if not points or len(points) % 2 or not all(math.isfinite(value) for value in points):
+            raise InvalidStrokes('Точки штриха - непустой список пар координат')
+        total += len(points) // 2
+        if total > max_points:
+            raise InvalidStrokes(f'В рисунке больше {max_points} точек')
+        parsed.append({'color': color, 'width': line_width, 'points': points})
+    return {'size': [width, height], 'strokes': parsed}
+
+
+def raster_size(log, width, max_side=2048):
+    # Размер растра по пропорциям листа; вытянутый лист (size [0.01, 10000])
+    # не должен превращаться в гигантское изображение
+    sheet_width, sheet_height = log['size']
+    height = max(1, round(sheet_height * width / sheet_width))
+    if height > max_side or width * height > max_side * max_side:
+        raise InvalidStrokes(f'Растр {width}x{height} больше допустимого ({max_side} по стороне)')
+    return width, height
+
+
+def rasterize(log, width, max_side=2048):
+    # Рисунок на прозрачном листе заданной ширины, как его отдаёт холст страницы
+    size = raster_size(log, width, max_side)
+    scale = width / log['size'][0]
+    image = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    for stroke in log['strokes']:
+        line_width = max(1, round(stroke['width'] * scale))
+        values = stroke['points']
+        points = [(x * scale, y * scale) for x, y in zip(values[::2], values[1::2])]
+        if len(points) > 1:
+            draw.line(points, fill=stroke['color'], width=line_width, joint='curve')
+        # Круглые концы, как lineCap = 'round' на холсте; у касания без движения - точка
+        radius = line_width / 2
+        for x, y in {points[0], points[-1]}:
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=stroke['color'])
+    return image
+
+
+def stroke_features(log):
+    # Признаки, которые по растру не восстановить: число и длина штрихов, толщина, цвета
+    sheet_width, sheet_height = log['size']
+    diagonal = math.hypot(sheet_width, sheet_height)
+    strokes = log['strokes']
+    lengths = []
+    for stroke in strokes:
+        values = stroke['points']
+        points = list(zip(values[::2], values[1::2]))
+        lengths.append(sum(math.dist(a, b) for a, b in zip(points, points[1:])))
+    count = len(strokes)
+    return {
+        'count': count,
+        'points': sum(len(stroke['points']) // 2 for stroke in strokes),
+        'length': round(sum(lengths) / diagonal, 3),
+        'mean_length': round(sum(lengths) / diagonal / count, 3) if count else 0.0,
+        'mean_width': round(sum(stroke['width'] for stroke in strokes) / sheet_width / count, 4) if count else 0.0,
+        'colors': len({stroke['color'].lower() for stroke in strokes}),
+    }
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class NotReady(Exception):
+    def __init__(self, retry_after):
+        super().__init__('Сервер ещё запускается, попробуйте позже')
+        self.retry_after = retry_after
+
+
+class Preflight:
+    """Подготовка процесса в фоновом потоке после запуска.
+
+    Шаги (имя, функция) выполняются по порядку: тяжёлые импорты, пробная обработка
+    изображения, клиенты провайдеров. Пока они идут, процесс уже отдаёт страницу и
+    служебные эндпоинты; запросы анализа ждут через require() только нужных им
+    шагов. Упавший шаг повторяется через retry_delay секунд, готовность процесса
+    выставляется только после успеха всех шагов.
+    """
+
+    def __init__(self, steps, retry_delay=5.0):
+        self.steps = steps
+        self.retry_delay = retry_delay
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._started = None
+        self._elapsed = None
+        self._steps = {name: {'status': 'pending'} for name, _ in steps}
+        self._done = {name: threading.Event() for name, _ in steps}
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._started = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name='preflight', daemon=True)
+        self._thread.start()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def require(self, timeout, steps=None):
+        # Ждём шагов steps (по умолчанию всех) не дольше timeout в сумме,
+        # затем просим клиента повторить позже
+        events = [self._ready] if steps is None else [self._done[name] for name in steps]
+        deadline = time.monotonic() + timeout
+        for event in events:
+            if not event.wait(max(0.0, deadline - time.monotonic())):
+                raise NotReady(retry_after=max(1, round(self.retry_delay)))
+
+    def stats(self):
+        with self._lock:
+            steps = {name: dict(step) for name, step in self._steps.items()}
+            elapsed = self._elapsed
+            if elapsed is None and self._started is not None:
+                elapsed = time.monotonic() - self._started
+        return {
+            'ready': self.ready,
+            'elapsed_ms': round(elapsed * 1000, 1) if elapsed is not None else None,
+            'steps': steps,
+        }
+
+    def _run(self):
+        for name, step in self.steps:
+            attempt = 0
+            while True:
+                attempt += 1
+                started = time.perf_counter()
+                try:
+                    step()
+                except Exception as e:
+                    logger.error('Прогрев: шаг %s не удался (попытка %d): %s', name, attempt, e)
+                    self._update(name, status='failed', attempts=attempt, error=str(e))
+                    time.sleep(self.retry_delay)
+                    continue
+                elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+                self._update(name, status='done', attempts=attempt, ms=elapsed_ms, error=None)
+                self._done[name].set()
+                break
+        with self._lock:
+            self._elapsed = time.monotonic() - self._started
+        self._ready.set()
+        logger.info('Прогрев завершён за %.0f мс', self._elapsed * 1000)
+
+    def _update(self, name, **fields):
+        with self._lock:
+            self._steps[name].update(fields)
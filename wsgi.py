@@ -0,0 +1,5 @@
+# Точка входа для production-сервера:
+#   gunicorn -c gunicorn.conf.py wsgi:app
+from app import app
+
+application = app